@@ -0,0 +1,204 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class MemoryCache:
+    """
+    In-process key-value cache with a time-to-live and size-bounded LRU eviction.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: Optional[float] = 3600):
+        """
+        :param max_size: int - Maximum number of entries kept before the least recently used is evicted.
+        :param ttl: Optional[float] - Seconds an entry stays valid (None for no expiry).
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the cached value for a key, or None if it is missing or expired.
+
+        :param key: str - The cache key.
+        :return: Optional[Any] - The cached value.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+
+        :param key: str - The cache key.
+        :param value: Any - The value to store.
+        """
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """
+    On-disk key-value cache backed by SQLite, so entries survive process restarts.
+    Values must be JSON serializable. Eviction is LRU on last access time.
+
+    A hit doesn't write to the database: access times are kept in memory and written in one
+    transaction every TOUCH_BATCH hits, or before the next set evicts entries.
+    """
+
+    # Number of buffered access times that triggers a write
+    TOUCH_BATCH = 64
+
+    def __init__(self, path: str, table: str = "cache", max_size: int = 1024, ttl: Optional[float] = 3600):
+        """
+        :param path: str - Path of the SQLite database file.
+        :param table: str - Table name, so several caches can share one database file.
+        :param max_size: int - Maximum number of entries kept before the least recently used is evicted.
+        :param ttl: Optional[float] - Seconds an entry stays valid (None for no expiry).
+        """
+        self.path = path
+        self.table = table
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._touched = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the cached value for a key, or None if it is missing or expired.
+
+        :param key: str - The cache key.
+        :return: Optional[Any] - The cached value.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, stored_at = row
+            now = time.time()
+            if self.ttl is not None and now - stored_at > self.ttl:
+                self._touched.pop(key, None)
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.TOUCH_BATCH:
+                self._flush_touched()
+                self._conn.commit()
+            return json.loads(value)
+
+    def _flush_touched(self):
+        # Writes the buffered access times, the caller holds the lock and commits the transaction
+        if self._touched:
+            self._conn.executemany(
+                f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def set(self, key: str, value: Any):
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+
+        :param key: str - The cache key.
+        :param value: Any - The JSON serializable value to store.
+        """
+        now = time.time()
+        with self._lock:
+            # Eviction below needs the buffered access times
+            self._touched.pop(key, None)
+            self._flush_touched()
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self._conn.commit()
+
+
+def create_cache(name: str,
+                 max_size: int = 256,
+                 ttl: Optional[float] = 3600,
+                 backend: Optional[str] = None,
+                 cache_dir: Optional[str] = None):
+    """
+    Creates a cache with the configured backend.
+
+    :param name: str - Name of the cache, used as the SQLite table name.
+    :param max_size: int - Maximum number of entries (default: 256).
+    :param ttl: Optional[float] - Seconds an entry stays valid (default: 3600).
+    :param backend: Optional[str] - "memory" or "sqlite" (default: the CACHE_BACKEND environment variable, else "memory").
+    :param cache_dir: Optional[str] - Folder of the SQLite database (default: data/cache next to this file).
+    :return: MemoryCache or SQLiteCache - The cache instance.
+    """
+    backend = (backend or os.getenv("CACHE_BACKEND", "memory")).lower()
+    if backend == "sqlite":
+        cache_dir = cache_dir or os.path.join(os.path.dirname(__file__), 'data', 'cache')
+        return SQLiteCache(os.path.join(cache_dir, 'cache.sqlite'), table=name, max_size=max_size, ttl=ttl)
+    if backend != "memory":
+        raise ValueError(f"Unknown cache backend: {backend}")
+    return MemoryCache(max_size=max_size, ttl=ttl)
+
+
+def make_cache_key(params: Dict) -> str:
+    """
+    Builds a stable cache key from a parameter dictionary. Keys are sorted, empty values dropped
+    and values compared as lower-case strings, so {"bedsMin": 1} and {"bedsMin": "1"} share a key.
+
+    :param params: Dict - The parameters to build the key from.
+    :return: str - The normalized cache key.
+    """
+    normalized = {
+        str(key): str(value).strip().lower()
+        for key, value in params.items()
+        if value is not None and str(value).strip() != ""
+    }
+    return json.dumps(normalized, sort_keys=True)
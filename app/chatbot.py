@@ -8,43 +8,99 @@ from prompt_creation import (
     generate_prompt_apifilter,
     generate_prompt_rag_international,
     generate_prompt_general,
-    generate_prompt_rewrite_query
+    generate_prompt_rewrite_query,
+    generate_prompt_route_extract
+)
+from prompt_budget import SECTION_BUDGETS
+from llm import get_chat_response, stream_chat_response
+from local_classifier import CONFIDENCE_THRESHOLD, decide_intent_locally, record_classification, get_classifier_stats
+from vector_search import (
+    hybrid_search,
+    hybrid_search_batch,
+    format_chunk_results,
+    reciprocal_rank_fusion,
+    needs_query_rewrite,
+    record_rewrite,
+    get_rewrite_stats,
+    expand_to_parents
 )
-from llm import get_chat_response
-from vector_search import search_similar_chunks, format_chunk_results, reciprocal_rank_fusion
 import json
+import time
 
 GOOGLE_MAPS_API_KEY = os.getenv("DEV_GOOGLE_MAP_API_KEY")
 
 
 # initial intent classifier
-def intent_classifier(chat, prompts_dict, user_query):
+# Confident cases are decided by local keyword rules, the LLM is only called when they are unsure
+def intent_classifier(chat, prompts_dict, user_query, threshold=CONFIDENCE_THRESHOLD):
+    local_intent = decide_intent_locally(user_query, threshold)
+    if local_intent is not None:
+        return local_intent
+
     prompt = generate_prompt_classifier(prompts_dict['instruction_classifier'], user_query)
     response = get_chat_response(chat, prompt)
-    print('Intent Number:', int(response))
+    record_classification(used_llm=True)
+    print('Intent Number:', int(response), 'Classifier stats:', get_classifier_stats())
     return int(response)
 
 
+# classify intent and extract the Zillow filter / Places query in a single LLM call
+def route_and_extract(chat, prompts_dict, user_query, threshold=CONFIDENCE_THRESHOLD):
+    # Confident local decisions skip the LLM, the handlers then extract their own parameters
+    local_intent = decide_intent_locally(user_query, threshold)
+    if local_intent is not None:
+        return {'intent': local_intent, 'api_filter': None, 'local_search': None}
+
+    prompt = generate_prompt_route_extract(
+        prompts_dict['instruction_route_extract'],
+        user_query,
+        locations_string=prompts_dict['zillow_locations'],
+        place_types=prompts_dict['google_place_types']
+    )
+    response = get_chat_response(chat, prompt)
+    record_classification(used_llm=True)
+    routed = extract_json_to_dict(response)
+    if isinstance(routed, dict) and str(routed.get('intent')).isdigit():
+        routed['intent'] = int(routed['intent'])
+
+    # Fall back to the standalone classifier if the combined answer can't be used
+    if not isinstance(routed, dict) or routed.get('intent') not in (0, 1, 2, 3, 9):
+        print('Invalid route/extract response, falling back to intent classifier:', response)
+        return {'intent': intent_classifier(chat, prompts_dict, user_query), 'api_filter': None, 'local_search': None}
+
+    # Drop parameters that are missing or malformed so the handlers extract them again
+    if not isinstance(routed.get('api_filter'), dict):
+        routed['api_filter'] = None
+    local_search = routed.get('local_search')
+    if not isinstance(local_search, dict) or 'search_string' not in local_search or 'included_type' not in local_search:
+        routed['local_search'] = None
+    print('Intent Number (route/extract):', routed['intent'], 'Classifier stats:', get_classifier_stats())
+    return routed
+
+
 # get property through zollow api
-def get_listings_from_zillow(chat, prompts_dict, user_query):
-    prompt = generate_prompt_apifilter(prompts_dict['instruction_apifilter'], user_query, locations_string = prompts_dict['zillow_locations'])
-    api_filter = get_chat_response(chat, prompt)
-    api_filter = extract_json_to_dict(api_filter)
+def get_listings_from_zillow(chat, prompts_dict, user_query, api_filter=None):
+    if api_filter is None:
+        prompt = generate_prompt_apifilter(prompts_dict['instruction_apifilter'], user_query, locations_string = prompts_dict['zillow_locations'])
+        api_filter = get_chat_response(chat, prompt)
+        api_filter = extract_json_to_dict(api_filter)
     top_properties = fetch_top_properties_detail(api_filter)
     return top_properties
     
 
 # get final response for property search
-def get_final_response_property(chat, prompts_dict, user_query, property_info, user_profile):
+def get_final_response_property(chat, prompts_dict, user_query, property_info, user_profile, stream=False):
     prompt = generate_prompt_property(prompts_dict['instruction_property_final'], user_query, property_info, user_profile)
+    if stream:
+        return stream_chat_response(chat, prompt)
     response = get_chat_response(chat, prompt)
     return response
 
 
 # chat function for property search
-def chat_property(chat, prompts_dict, user_query, user_profile):
+def chat_property(chat, prompts_dict, user_query, user_profile, stream=False, api_filter=None):
     # Fetch top properties from Zillow
-    top_properties = get_listings_from_zillow(chat, prompts_dict, user_query)
+    top_properties = get_listings_from_zillow(chat, prompts_dict, user_query, api_filter=api_filter)
     print('Top properties:', top_properties)
     # Use only property information(Add information if needed)
     property_info_final = top_properties
@@ -54,7 +110,8 @@ def chat_property(chat, prompts_dict, user_query, user_profile):
         prompts_dict,
         user_query,
         property_info=property_info_final,
-        user_profile=user_profile
+        user_profile=user_profile,
+        stream=stream
     )
     # Generate the property map
     map_html = create_property_map(api_key=GOOGLE_MAPS_API_KEY, top_properties=top_properties)  
@@ -82,41 +139,57 @@ def rewrite_queries(chat, prompts_dict, user_query):
 
 
 # chat function for international students
-def chat_international(chat, prompts_dict, user_query, vectordb, user_profile, fusion=False):
+# With fusion, the original query is searched first and only rewritten when it retrieves weakly
+def chat_international(chat, prompts_dict, user_query, vectordb, user_profile, fusion=False, stream=False):
 
     if fusion:
-        rewritten_queries = rewrite_queries(chat, prompts_dict, user_query)
-        all_results = []
-        for query in rewritten_queries:
-            chunks = search_similar_chunks(vectorstore=vectordb, query=query, k=5)
-            all_results.append(chunks)
-        chunks = reciprocal_rank_fusion(all_results, top_n=5)
+        # The confidence comes from the dense search of the original query, no second search
+        chunks, confidence = hybrid_search(vectorstore=vectordb, query=user_query, k=5, mmr=True, with_confidence=True)
+        if needs_query_rewrite(confidence):
+            start_time = time.perf_counter()
+            rewritten_queries = rewrite_queries(chat, prompts_dict, user_query)
+            record_rewrite(skipped=False, rewrite_seconds=time.perf_counter() - start_time)
+            # Embed and search the rewrites in one batch, dense and BM25 rankings fused per rewrite
+            other_queries = [query for query in rewritten_queries if query != user_query]
+            all_results = [chunks] + hybrid_search_batch(vectorstore=vectordb, queries=other_queries, k=5, mmr=True)
+            chunks = reciprocal_rank_fusion(all_results, top_n=5)
+        else:
+            record_rewrite(skipped=True)
+        print('Retrieval confidence:', confidence, 'Rewrite stats:', get_rewrite_stats())
     else:
-        chunks = search_similar_chunks(vectorstore=vectordb, query=user_query, k=5)
+        chunks = hybrid_search(vectorstore=vectordb, query=user_query, k=5, mmr=True)
+    # Small chunks are matched, their parent sections are given to the LLM
+    chunks = expand_to_parents(vectordb, chunks)
     
     chunks_formated = format_chunk_results(
             chunks,
             metadata_fields=['source', 'source_type'],
-            include_content=True
+            include_content=True,
+            token_budget=SECTION_BUDGETS["CONTEXT"]
             )
     # print('Contexts:', chunks_formated)
     prompt_rag_international = generate_prompt_rag_international(prompts_dict['instruction_rag_international'], chunks_formated, user_query, user_profile)
+    if stream:
+        return stream_chat_response(chat, prompt_rag_international)
     response_international_final = get_chat_response(chat, prompt_rag_international)
     return response_international_final
 
 
 # chat function for general intent
-def chat_general(chat, prompts_dict, user_query, user_profile):
+def chat_general(chat, prompts_dict, user_query, user_profile, stream=False):
     prompt_general = generate_prompt_general(prompts_dict['instruction_general'], user_query, user_profile)
+    if stream:
+        return stream_chat_response(chat, prompt_general)
     response_general_final = get_chat_response(chat, prompt_general)
     return response_general_final
 
 
 # chat function for local advisor
-def chat_local_advisor(chat, prompts_dict, user_query, api_key, user_profile):
-    # Refine the user's query with LLM
-    instruction = prompts_dict["instruction_local_advisor"]
-    refined_query = generate_local_search_query(chat, instruction, user_query)
+def chat_local_advisor(chat, prompts_dict, user_query, api_key, user_profile, stream=False, refined_query=None):
+    # Refine the user's query with LLM, unless it was already extracted while routing
+    if refined_query is None:
+        instruction = prompts_dict["instruction_local_advisor"]
+        refined_query = generate_local_search_query(chat, instruction, user_query)
 
     search_string = refined_query["search_string"]
     included_type = refined_query["included_type"]
@@ -127,9 +200,11 @@ def chat_local_advisor(chat, prompts_dict, user_query, api_key, user_profile):
     # Generate a response for the user using LLM
     if places:
         response_instruction = prompts_dict["instruction_local_advisor_response"]
-        response = generate_local_advisor_response(chat, response_instruction, user_query, places, user_profile)
+        response = generate_local_advisor_response(chat, response_instruction, user_query, places, user_profile, stream=stream)
     else:
         response = f"Sorry, I couldn't find any results for '{search_string}'."
+        if stream:
+            response = iter([response])
 
     # Step 4: Generate the map HTML
     map_html = create_local_advisor_map(api_key, places)
@@ -138,22 +213,30 @@ def chat_local_advisor(chat, prompts_dict, user_query, api_key, user_profile):
 
 
 # main chat function based on user's intent
-def chat_all(chat, prompts_dict, user_query, vectordb, user_profile):
-    
-    intent_int = intent_classifier(chat, prompts_dict, user_query)
+# With stream=True the response is returned as an iterator of text chunks instead of a string
+# With route_extract=True queries the local classifier is unsure about are classified and their
+# search parameters extracted in one LLM call
+def chat_all(chat, prompts_dict, user_query, vectordb, user_profile, stream=False, route_extract=True):
+
+    api_filter, local_search = None, None
+    if route_extract:
+        routed = route_and_extract(chat, prompts_dict, user_query)
+        intent_int, api_filter, local_search = routed['intent'], routed['api_filter'], routed['local_search']
+    else:
+        intent_int = intent_classifier(chat, prompts_dict, user_query)
     # Property intent
     if intent_int == 1:
-        response_property_final, map_html = chat_property(chat, prompts_dict, user_query, user_profile)
+        response_property_final, map_html = chat_property(chat, prompts_dict, user_query, user_profile, stream=stream, api_filter=api_filter)
         return response_property_final, map_html, intent_int
     # Local Advisor intent
     elif intent_int == 2:
-        response_local_advisor, map_html = chat_local_advisor(chat, prompts_dict, user_query, GOOGLE_MAPS_API_KEY, user_profile)
+        response_local_advisor, map_html = chat_local_advisor(chat, prompts_dict, user_query, GOOGLE_MAPS_API_KEY, user_profile, stream=stream, refined_query=local_search)
         return response_local_advisor, map_html, intent_int
     # International Student Advisor intent
     elif intent_int == 3:
-        response_international_final = chat_international(chat, prompts_dict, user_query, vectordb, user_profile, fusion=True)
+        response_international_final = chat_international(chat, prompts_dict, user_query, vectordb, user_profile, fusion=True, stream=stream)
         return response_international_final, None, intent_int
     # Other intent
     else:
-        response_default = chat_general(chat, prompts_dict, user_query, user_profile)
+        response_default = chat_general(chat, prompts_dict, user_query, user_profile, stream=stream)
         return response_default, None, intent_int
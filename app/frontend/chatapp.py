@@ -1,5 +1,4 @@
 import streamlit as st
-import time
 from settings import setup, configure_display_options
 from chatbot import chat_all
 from frontend.app_elements import load_image_as_base64, preprocess_markdown
@@ -175,29 +174,22 @@ def chat_app():
         with st.chat_message("user"):
             st.markdown(user_input)
 
-        # Process the user input with the chatbot
-        response, map_html, intent = chat_all(
-            st.session_state.chat,
-            st.session_state.prompts_dict,
-            user_input,
-            st.session_state.vectordb,
-            st.session_state.user_onboarding_data[current_user]
-        )
-
         # Display the chatbot's response
         with st.chat_message("assistant"):
-            placeholder = st.empty()
-            gradual_text = ""
-
+            # Process the user input with the chatbot, the final answer is streamed token by token
             with st.spinner("Thinking..."):
-                for word in response.split():
-                    gradual_text += word + " "
-                    placeholder.text(gradual_text)
-                    time.sleep(0.05)
-
-            # Finalize the placeholder with the complete response - Will
+                response_stream, map_html, intent = chat_all(
+                    st.session_state.chat,
+                    st.session_state.prompts_dict,
+                    user_input,
+                    st.session_state.vectordb,
+                    st.session_state.user_onboarding_data[current_user],
+                    stream=True
+                )
+
+            # write_stream renders chunks as they arrive and returns the complete response - Will
             # response = preprocess_markdown(response)
-            placeholder.markdown(response)
+            response = st.write_stream(response_stream)
 
         # Add the response to chat history
         st.session_state.chat_histories[current_user].append({"role": "assistant", "content": response})
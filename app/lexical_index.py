@@ -0,0 +1,206 @@
+import os
+import re
+from collections import Counter
+from typing import Iterable, List, Tuple
+import numpy as np
+
+
+# Keeps hyphenated acronyms such as "i-20", "f-1" or "u-ship" together as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from have how i if in into is it its me my of on or our
+should so than that the their them then there these they this to was we what when where which who why
+will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lower-case search terms.
+
+    Hyphenated terms are kept whole and also indexed without hyphens, so "I-20" matches "i20".
+    Stopwords are dropped and a plural "s" is stripped from longer terms ("visas" -> "visa").
+
+    :param text: str - The text to tokenize.
+    :return: List[str] - The search terms, in order.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+        if "-" in token:
+            tokens.append(token.replace("-", ""))
+    return tokens
+
+
+class BM25Index:
+    """
+    In-process BM25 inverted index over the chunks of a vector store.
+
+    Postings are stored in CSR form (one slice of rows and term frequencies per term), so a query
+    only touches the postings of its own terms and scoring is a handful of NumPy operations.
+    Rows are the FAISS rows of the chunks, so lexical and dense hits share one id space.
+    The vocabulary is a sorted array of UTF-8 terms looked up by binary search, so a saved index
+    is used memory-mapped, without building anything at load time.
+    """
+
+    # Arrays of a saved index, one .npy file each
+    ARRAYS = ("terms", "indptr", "rows", "term_freqs", "idf", "length_norm", "params")
+
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, rows: np.ndarray, term_freqs: np.ndarray,
+                 idf: np.ndarray, length_norm: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        """
+        :param terms: np.ndarray - Sorted UTF-8 vocabulary, position i owns postings indptr[i]:indptr[i + 1].
+        :param indptr: np.ndarray - Start offset of every term's postings, plus the total length.
+        :param rows: np.ndarray - Chunk row of every posting.
+        :param term_freqs: np.ndarray - Term frequency of every posting.
+        :param idf: np.ndarray - Inverse document frequency of every term.
+        :param length_norm: np.ndarray - BM25 length normalization of every chunk.
+        :param k1: float - BM25 term frequency saturation (default: 1.5).
+        :param b: float - BM25 length normalization (default: 0.75).
+        """
+        self.terms = terms
+        self.indptr = indptr
+        self.rows = rows
+        self.term_freqs = term_freqs
+        self.idf = idf
+        self.length_norm = length_norm
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def from_postings(cls, terms: List[str], indptr: np.ndarray, rows: np.ndarray, term_freqs: np.ndarray,
+                      doc_lengths: np.ndarray, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """
+        Build the index from CSR postings in any term order, sorting the vocabulary.
+
+        :param terms: List[str] - Vocabulary, position i owns postings indptr[i]:indptr[i + 1].
+        :param indptr: np.ndarray - Start offset of every term's postings, plus the total length.
+        :param rows: np.ndarray - Chunk row of every posting.
+        :param term_freqs: np.ndarray - Term frequency of every posting.
+        :param doc_lengths: np.ndarray - Number of terms of every chunk.
+        :param k1: float - BM25 term frequency saturation (default: 1.5).
+        :param b: float - BM25 length normalization (default: 0.75).
+        :return: BM25Index - The index.
+        """
+        encoded = np.asarray([term.encode("utf-8") for term in terms], dtype=np.bytes_)
+        order = np.argsort(encoded, kind="stable")
+        counts = np.diff(indptr)[order]
+        sorted_indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=sorted_indptr[1:])
+        # Position of every sorted posting in the original arrays
+        postings = np.repeat(indptr[:-1][order] - sorted_indptr[:-1], counts) + np.arange(sorted_indptr[-1])
+
+        n_docs = len(doc_lengths)
+        idf = np.log(1 + (n_docs - counts + 0.5) / (counts + 0.5))
+        average_length = doc_lengths.mean() if n_docs else 1.0
+        length_norm = k1 * (1 - b + b * doc_lengths / max(average_length, 1e-9))
+        return cls(encoded[order], sorted_indptr, rows[postings], term_freqs[postings], idf,
+                   length_norm.astype(np.float32), k1=k1, b=b)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """
+        Build the index over chunk texts, row i being the i-th text. The texts are consumed once,
+        so they can be streamed, e.g. from the store's SQLite docstore.
+
+        :param texts: Iterable[str] - The chunk texts in FAISS row order.
+        :param k1: float - BM25 term frequency saturation (default: 1.5).
+        :param b: float - BM25 length normalization (default: 0.75).
+        :return: BM25Index - The built index.
+        """
+        vocabulary = {}
+        term_ids, rows, term_freqs, doc_lengths = [], [], [], []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                rows.append(row)
+                term_freqs.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=indptr[1:])
+        return cls.from_postings(
+            terms=list(vocabulary),
+            indptr=indptr,
+            rows=np.asarray(rows, dtype=np.int32)[order],
+            term_freqs=np.asarray(term_freqs, dtype=np.float32)[order],
+            doc_lengths=np.asarray(doc_lengths, dtype=np.float32),
+            k1=k1,
+            b=b,
+        )
+
+    def term_id(self, term: str) -> int:
+        """
+        Find a term in the vocabulary.
+
+        :param term: str - The search term.
+        :return: int - Position of the term, -1 if it isn't indexed.
+        """
+        encoded = term.encode("utf-8")
+        position = int(np.searchsorted(self.terms, encoded))
+        if position < len(self.terms) and self.terms[position] == encoded:
+            return position
+        return -1
+
+    def search(self, query: str, k: int = 20) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rank chunks for a query by BM25 score.
+
+        :param query: str - The search query.
+        :param k: int - Maximum number of rows to return (default: 20).
+        :return: Tuple[np.ndarray, np.ndarray] - Matching rows and their scores, best first.
+        """
+        scores = np.zeros(len(self.length_norm), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.term_id(term)
+            if term_id < 0:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            rows, freqs = self.rows[start:end], self.term_freqs[start:end]
+            scores[rows] += self.idf[term_id] * freqs * (self.k1 + 1) / (freqs + self.length_norm[rows])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return matched, scores[matched]
+
+    def save(self, path: str):
+        """
+        Save the index as a folder of pickle-free .npy files, one per array.
+
+        :param path: str - Destination folder.
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {"terms": self.terms, "indptr": self.indptr, "rows": self.rows, "term_freqs": self.term_freqs,
+                  "idf": self.idf, "length_norm": self.length_norm, "params": np.asarray([self.k1, self.b])}
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), arrays[name])
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        Load an index saved with save, memory-mapped so loading costs the same for any corpus size.
+        A .npz file written by earlier versions is read into memory instead.
+
+        :param path: str - The index folder, or a legacy .npz file.
+        :return: BM25Index - The loaded index.
+        """
+        if os.path.isfile(path):
+            with np.load(path, allow_pickle=False) as data:
+                k1, b = data["params"]
+                return cls.from_postings(data["terms"].tolist(), data["indptr"], data["rows"], data["term_freqs"],
+                                         data["doc_lengths"], k1=float(k1), b=float(b))
+
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+                  for name in cls.ARRAYS}
+        k1, b = arrays.pop("params")
+        return cls(**arrays, k1=float(k1), b=float(b))
@@ -1,3 +1,4 @@
+from typing import Iterator
 import vertexai
 from vertexai.preview.generative_models import GenerativeModel, ChatSession
 import vertexai.preview.generative_models as generative_models
@@ -32,22 +33,59 @@ def start_chat_session() -> ChatSession:
     return model.start_chat(response_validation=False)
 
 
+FALLBACK_RESPONSE = "I'm sorry, but your question was detected to contain harmful or personally identifiable information. To protect our users and your privacy, I cannot provide an answer to that specific query. Please remove any harmful or personally identifiable information and try again."
+
+# Closes a streamed answer that was blocked after part of it was already shown
+INTERRUPTED_RESPONSE = "\n\n---\n*The rest of this answer was withheld by the content filter.*"
+
+
+def _response_chunks(chat: ChatSession, prompt: str) -> Iterator[str]:
+    """
+    Sends a prompt to the chat session and yields the response text chunk by chunk as it arrives.
+    Errors (e.g. a safety block, raised as ValueError) are left to the caller.
+
+    :param chat: ChatSession - An active chat session with the generative model.
+    :param prompt: str - The user's input or query for which a response is requested.
+    :return: Iterator[str] - Text chunks of the response, in the order they are received.
+    """
+    responses = chat.send_message(prompt, stream=True)
+    for chunk in responses:
+        if hasattr(chunk, 'text'):
+            yield chunk.text
+
+
+def stream_chat_response(chat: ChatSession, prompt: str) -> Iterator[str]:
+    """
+    Sends a prompt to the chat session and yields the response text chunk by chunk as it arrives.
+
+    :param chat: ChatSession - An active chat session with the generative model.
+    :param prompt: str - The user's input or query for which a response is requested.
+    :return: Iterator[str] - Text chunks of the response, in the order they are received.
+    """
+    started = False
+    try:
+        for text in _response_chunks(chat, prompt):
+            started = True
+            yield text
+    except ValueError as e:
+        print(f"Error occurred: {e}")
+        # The fallback replaces the answer only if none of it was shown yet, else the answer is closed
+        # with a separate notice so it isn't run together with the partial text
+        yield INTERRUPTED_RESPONSE if started else FALLBACK_RESPONSE
+
+
 def get_chat_response(chat: ChatSession, prompt: str) -> str:
     """
     Sends a prompt to the chat session and returns the full response.
 
     :param chat: ChatSession - An active chat session with the generative model.
     :param prompt: str - The user's input or query for which a response is requested.
-    :return: str - The full concatenated response from the chat model.
+    :return: str - The full concatenated response from the chat model, or only the fallback response on error.
     """
+    # Partial output is discarded on error, callers parse this response as an int or JSON
     try:
-        text_response = []
-        responses = chat.send_message(prompt, stream=True)
-        for chunk in responses:
-            if hasattr(chunk, 'text'):
-                text_response.append(chunk.text)
-        return "".join(text_response)
+        return "".join(_response_chunks(chat, prompt))
     except ValueError as e:
         print(f"Error occurred: {e}")
         # Return a fallback response
-        return "I'm sorry, but your question was detected to contain harmful or personally identifiable information. To protect our users and your privacy, I cannot provide an answer to that specific query. Please remove any harmful or personally identifiable information and try again."
+        return FALLBACK_RESPONSE
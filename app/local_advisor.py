@@ -1,5 +1,5 @@
 import requests
-from llm import get_chat_response
+from llm import get_chat_response, stream_chat_response
 from prompt_creation import generate_prompt_local_advisor, generate_prompt_local_advisor_response
 from property_info import extract_json_to_dict
 
@@ -74,7 +74,7 @@ def search_google_places(api_key, search_string, included_type):
         raise ValueError(f"Google Places API error: {response.status_code} {response.text}")
 
 
-def generate_local_advisor_response(chat, instruction, user_query, places, user_profile):
+def generate_local_advisor_response(chat, instruction, user_query, places, user_profile, stream=False):
     """
     Generates a response for the Local Advisor using LLM.
 
@@ -83,8 +83,11 @@ def generate_local_advisor_response(chat, instruction, user_query, places, user_
     :param user_query: str - The user's query.
     :param places: list - A list of places from the Google Places API.
     :param user_profile: dict - The user's profile information.
-    :return: str - The generated response from the LLM.
+    :param stream: bool - Whether to return the response as an iterator of text chunks (default: False).
+    :return: str or Iterator[str] - The generated response from the LLM.
     """
     prompt = generate_prompt_local_advisor_response(instruction, user_query, places, user_profile)
+    if stream:
+        return stream_chat_response(chat, prompt)
     response = get_chat_response(chat, prompt)
     return response
\ No newline at end of file
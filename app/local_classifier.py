@@ -0,0 +1,187 @@
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+
+# Intent numbers follow prompts/instruction_classifier.txt
+INTENT_PROPERTY = 1
+INTENT_LOCAL_ADVISOR = 2
+INTENT_INTERNATIONAL = 3
+
+# Minimum confidence for a local decision, below this the LLM classifier is called
+CONFIDENCE_THRESHOLD = 0.75
+
+# Minimum number of independent rule hits (non-overlapping matches) for a local decision.
+# A single keyword is too weak: "Is it pet-friendly?" is a follow-up, not a new search.
+MIN_RULE_HITS = 2
+
+# Keyword rules per intent. Each pattern that matches counts as one piece of evidence.
+INTENT_PATTERNS = {
+    INTENT_PROPERTY: [
+        r"\bapartments?\b",
+        r"\bapts?\b",
+        r"\bstudios?\b",
+        r"\bcondos?\b",
+        r"\btown ?homes?\b",
+        r"\bhouses? (for|to) (rent|sale|buy)\b",
+        r"\b(\d+|one|two|three|four)[- ]?(bed(room)?s?|br|bd)\b",
+        r"\bfor (rent|sale)\b",
+        r"\brent(al)?s?\b",
+        r"\bsublet\b",
+        r"\baccommodations?\b",
+        r"\bpet[- ]friendly\b",
+        r"\bsq(uare)? ?(ft|feet)\b",
+        r"\bper month\b|/ ?mo(nth)?\b",
+    ],
+    INTENT_LOCAL_ADVISOR: [
+        r"\brestaurants?\b",
+        r"\b(cafes?|coffee( shops?)?|bakery|bakeries|bars?|pubs?)\b",
+        r"\bgrocer(y|ies)\b|\bsupermarkets?\b",
+        r"\b(sushi|pizza|ramen|tacos?|brunch|dinner|lunch|breakfast)\b",
+        r"\b(museums?|parks|zoo|aquarium|attractions?|sightseeing)\b",
+        r"\bthings to do\b|\bshow (them|me) around\b",
+        r"\b(gyms?|fitness( centers?)?|yoga)\b",
+        r"\b(pharmac(y|ies)|drugstores?|laundromats?|laundry)\b",
+        r"\b(stores?|shops?|shopping|malls?|furniture)\b",
+        r"\b(train|bus|cta|l) (stations?|stops?)\b",
+        r"\bwhere (can|should|do) (i|we) (eat|buy|get|go|find|take)\b",
+        r"\bnear(by| me)\b",
+        r"\bevents?\b",
+    ],
+    INTENT_INTERNATIONAL: [
+        r"\bvisas?\b",
+        r"\b[fj]-?1\b",
+        r"\bi-?20\b|\bds-?2019\b",
+        r"\bsevis\b",
+        r"\b(opt|cpt)\b",
+        r"\bssn\b|\bsocial security\b",
+        r"\bitin\b",
+        r"\b(health )?insurance\b|\bu-?ship\b",
+        r"\bimmuni[sz]ations?\b|\bvaccin(e|es|ation)\b",
+        r"\bdriver'?s'? licen[cs]e\b|\bstate id\b",
+        r"\bbank accounts?\b|\bbanking\b",
+        r"\btax(es)?\b",
+        r"\binternational students?\b",
+        r"\b(phone|mobile) plan\b",
+        r"\bcultur(e|al)\b",
+        r"\bdocuments?\b|\bpaperwork\b",
+        r"\b(change|changing|maintain|maintaining) (my )?status\b",
+        r"\bscams?\b",
+    ],
+}
+
+# Phrases that point back to earlier turns. The LLM sees the conversation history,
+# so these queries are always left to it.
+FOLLOW_UP_PATTERNS = [
+    r"\b(it|they|them)\b",
+    r"\b(that|this|its|their|the same) (one|place|property|apartment|apt|unit|listing|house|home|condo|studio|"
+    r"building|restaurant|cafe|shop|store|area|neighborhood|location|landlord|lease|price|rent)s?\b",
+    r"\b(near|over|from|around|in) there\b",
+    r"\b(these|those|above|aforementioned)\b",
+    r"\b(first|second|third|fourth|fifth|last) (one|property|properties|option|listing|place|restaurant|apartment)\b",
+    r"\boption \d\b",
+    r"\byou (just )?(mentioned|listed|showed|recommended|suggested|said)\b",
+    r"\b(our|this) conversation\b",
+    r"\babout me\b",
+]
+
+_COMPILED_PATTERNS = {
+    intent: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    for intent, patterns in INTENT_PATTERNS.items()
+}
+_COMPILED_FOLLOW_UP = re.compile("|".join(FOLLOW_UP_PATTERNS), re.IGNORECASE)
+
+# Counters for how often the local classifier decides on its own vs. falls back to the LLM
+_stats_lock = threading.Lock()
+_classifier_stats = {"local": 0, "llm_fallback": 0}
+
+
+def score_intents(user_query: str) -> Dict[int, int]:
+    """
+    Counts how many keyword rules of each intent match the user query independently.
+
+    A rule only counts if its match doesn't overlap the match of a rule already counted, so
+    "for rent" is one piece of evidence even though two rules match it.
+
+    :param user_query: str - The user's original query.
+    :return: Dict[int, int] - A dictionary mapping intent numbers to the number of independent rule hits.
+    """
+    scores = {}
+    for intent, patterns in _COMPILED_PATTERNS.items():
+        spans = []
+        for pattern in patterns:
+            match = pattern.search(user_query)
+            if match and not any(match.start() < end and start < match.end() for start, end in spans):
+                spans.append(match.span())
+        scores[intent] = len(spans)
+    return scores
+
+
+def classify_intent_locally(user_query: str) -> Tuple[Optional[int], float]:
+    """
+    Classifies the user query with keyword rules, without calling the LLM.
+
+    Confidence is the share of rule hits belonging to the top intent, damped so that a few
+    matches never count as certain. Queries with fewer than MIN_RULE_HITS independent hits for
+    the top intent and follow-up queries always get zero confidence.
+
+    :param user_query: str - The user's original query.
+    :return: Tuple[Optional[int], float] - The predicted intent (None if no rule matched) and its confidence between 0 and 1.
+    """
+    if _COMPILED_FOLLOW_UP.search(user_query):
+        return None, 0.0
+
+    scores = score_intents(user_query)
+    total = sum(scores.values())
+    if total == 0:
+        return None, 0.0
+
+    intent, top_score = max(scores.items(), key=lambda x: x[1])
+    if top_score < MIN_RULE_HITS:
+        return intent, 0.0
+    confidence = top_score / (total + 0.25)
+    return intent, confidence
+
+
+def decide_intent_locally(user_query: str, threshold: float = CONFIDENCE_THRESHOLD) -> Optional[int]:
+    """
+    Returns the intent of the query if the keyword rules are confident enough to skip the LLM.
+
+    Local decisions are recorded in the classifier stats, the caller records the LLM fallback.
+
+    :param user_query: str - The user's original query.
+    :param threshold: float - Minimum confidence for a local decision (default: CONFIDENCE_THRESHOLD).
+    :return: Optional[int] - The intent, or None if the LLM classifier has to decide.
+    """
+    intent, confidence = classify_intent_locally(user_query)
+    if intent is None or confidence < threshold:
+        return None
+    record_classification(used_llm=False)
+    print('Intent Number (local):', intent, 'Confidence:', round(confidence, 2))
+    return intent
+
+
+def record_classification(used_llm: bool):
+    """
+    Records whether a query was classified locally or had to fall back to the LLM.
+
+    :param used_llm: bool - True if the LLM classifier was called.
+    """
+    with _stats_lock:
+        if used_llm:
+            _classifier_stats["llm_fallback"] += 1
+        else:
+            _classifier_stats["local"] += 1
+
+
+def get_classifier_stats() -> Dict:
+    """
+    Returns the classification counters collected since the process started.
+
+    :return: Dict - Counts of local and LLM classifications, and the LLM fallback rate.
+    """
+    with _stats_lock:
+        stats = dict(_classifier_stats)
+    total = stats["local"] + stats["llm_fallback"]
+    stats["fallback_rate"] = stats["llm_fallback"] / total if total else 0.0
+    return stats
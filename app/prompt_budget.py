@@ -0,0 +1,373 @@
+import json
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Gemini model whose tokenizer counts prompt tokens, the chat model of llm.py
+TOKENIZER_MODEL = os.getenv("PROMPT_TOKENIZER_MODEL", "gemini-1.5-flash-002")
+
+_tokenizer_lock = threading.Lock()
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def get_tokenizer():
+    """
+    Returns the local Gemini tokenizer of TOKENIZER_MODEL, loaded on first use.
+
+    vertexai.preview.tokenization counts tokens in-process with the model's SentencePiece
+    vocabulary (downloaded once and cached), so counting costs no API call. It needs sentencepiece.
+
+    :return: The tokenizer, or None if it can't be loaded (token counts then use regex_token_estimate).
+    """
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                try:
+                    from vertexai.preview.tokenization import get_tokenizer_for_model
+                    _tokenizer = get_tokenizer_for_model(TOKENIZER_MODEL)
+                except Exception as e:
+                    print(f"Local tokenizer for {TOKENIZER_MODEL} unavailable, using the regex token estimate: {e}")
+                _tokenizer_loaded = True
+    return _tokenizer
+
+
+# Fallback pre-tokenizer: words, single digits, single symbols and line breaks
+TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d|[^\w\s]|_|\n")
+
+# Characters per token for long words, which SentencePiece splits into several pieces
+WORD_PIECE_LENGTH = 6
+
+
+def _piece_tokens(piece: str) -> int:
+    return (len(piece) + WORD_PIECE_LENGTH - 1) // WORD_PIECE_LENGTH
+
+
+def regex_token_estimate(text: str) -> int:
+    """
+    Approximate token count used when the local tokenizer is unavailable.
+
+    Words count one token per started 6 characters, digits and symbols one token each, as the
+    Gemini tokenizer splits numbers into digits. The error of this estimate against the tokenizer
+    has not been measured in this repo, run measure_estimate_error on real prompts to calibrate it.
+
+    :param text: str - The text to measure.
+    :return: int - The estimated token count.
+    """
+    return sum(_piece_tokens(piece) for piece in TOKEN_PATTERN.findall(text))
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Count the LLM tokens of a text locally, without calling the API: exactly with the local
+    Gemini tokenizer, or with regex_token_estimate if it isn't available.
+
+    :param text: str - The text to measure.
+    :return: int - The token count.
+    """
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return regex_token_estimate(text)
+    return tokenizer.count_tokens(text).total_tokens
+
+
+def measure_estimate_error(texts: List[str]) -> Optional[Dict]:
+    """
+    Compare regex_token_estimate with the local tokenizer's counts over sample texts.
+
+    :param texts: List[str] - Sample texts, e.g. rendered prompts.
+    :return: Optional[Dict] - Mean and maximum relative error and the mean signed bias, or None without the tokenizer.
+    """
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return None
+    errors = []
+    for text in texts:
+        actual = tokenizer.count_tokens(text).total_tokens
+        if actual:
+            errors.append((regex_token_estimate(text) - actual) / actual)
+    if not errors:
+        return None
+    result = {
+        "texts": len(errors),
+        "mean_abs_error": sum(abs(error) for error in errors) / len(errors),
+        "max_abs_error": max(abs(error) for error in errors),
+        "mean_bias": sum(errors) / len(errors),
+    }
+    print(f"Regex token estimate over {result['texts']} texts: mean error {result['mean_abs_error']:.1%}, "
+          f"max {result['max_abs_error']:.1%}, bias {result['mean_bias']:+.1%}")
+    return result
+
+
+def fits_by_length(text: str, max_tokens: int) -> bool:
+    """
+    Cheap check that a text is within a token budget without tokenizing it: every token covers
+    at least one UTF-8 byte, so a text of at most max_tokens bytes always fits.
+
+    :param text: str - The text to check.
+    :param max_tokens: int - The token budget.
+    :return: bool - True if the text surely fits, False if it has to be counted.
+    """
+    return len(text) <= max_tokens and len(text.encode("utf-8")) <= max_tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = " ...", tokens: Optional[int] = None) -> str:
+    """
+    Cut a text to at most max_tokens tokens, at the last sentence or line end if one is in the
+    second half of the kept text, else at the last word or symbol boundary.
+
+    :param text: str - The text to truncate.
+    :param max_tokens: int - Maximum tokens to keep.
+    :param marker: str - Appended when the text was cut (default: " ...").
+    :param tokens: Optional[int] - Token count of the text if already known (default: None, counted here).
+    :return: str - The text, truncated if it was over the budget.
+    """
+    if fits_by_length(text, max_tokens):
+        return text
+    if tokens is None:
+        tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # The marker counts towards the budget
+    max_tokens = max(max_tokens - estimate_tokens(marker), 0)
+
+    boundaries = [match.end() for match in TOKEN_PATTERN.finditer(text)]
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        kept, tokens = 0, 0
+        for match in TOKEN_PATTERN.finditer(text):
+            tokens += _piece_tokens(match.group())
+            if tokens > max_tokens:
+                break
+            kept += 1
+    else:
+        # Longest prefix of whole pieces within the budget, by binary search over the tokenizer's counts
+        low, high = 0, len(boundaries)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if tokenizer.count_tokens(text[:boundaries[middle - 1]]).total_tokens <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        kept = low
+
+    cut = text[:boundaries[kept - 1]] if kept else ""
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary >= len(cut) // 2:
+        cut = cut[:boundary + 1]
+    return cut.rstrip() + marker
+
+
+# Token budget per prompt section (None for no limit), overridable with PROMPT_BUDGET_<SECTION>
+DEFAULT_SECTION_BUDGETS = {
+    "USER_QUERY": 500,
+    "USER_PROFILE": 300,
+    "CONTEXT": 1500,
+    "PROPERTY_INFO": 2500,
+    "PLACES": 1000,
+    "LOCATIONS_STRING": None,
+    "PLACE_TYPES": None,
+    "CATEGORIES_STRING": None,
+}
+SECTION_BUDGETS = {
+    name: int(os.environ[f"PROMPT_BUDGET_{name}"]) if f"PROMPT_BUDGET_{name}" in os.environ else budget
+    for name, budget in DEFAULT_SECTION_BUDGETS.items()
+}
+
+# Fields of a property listing worth the prompt tokens; images, coordinates and ids only feed the map
+PROPERTY_FIELDS = ["address", "price", "bedrooms", "bathrooms", "detailUrl", "description", "resoFacts", "schools"]
+SCHOOL_FIELDS = ["name", "rating", "distance", "level", "grades", "type"]
+MAX_SCHOOLS = 3
+MAX_DESCRIPTION_TOKENS = 200
+
+# Fields of a Places result the answer can use; photos, attributions, icons and geometry are dropped
+PLACE_FIELDS = ["name", "formatted_address", "rating", "user_ratings_total", "price_level",
+                "business_status", "opening_hours", "types", "google_maps_link"]
+MAX_PLACE_TYPES = 3
+
+
+def project_properties(properties: List[Dict]) -> List[Dict]:
+    """
+    Keep only the listing fields the property answer needs: no image, coordinates or zpid, at most
+    MAX_SCHOOLS schools with their key fields, no "N/A" resoFacts and a shortened description.
+
+    :param properties: List[Dict] - Listings from property_info.fetch_top_properties_detail.
+    :return: List[Dict] - Projected copies of the listings.
+    """
+    if not isinstance(properties, list):
+        return properties
+
+    projected = []
+    for prop in properties:
+        if not isinstance(prop, dict):
+            projected.append(prop)
+            continue
+        item = {field: prop[field] for field in PROPERTY_FIELDS if field in prop}
+        if isinstance(item.get("description"), str):
+            item["description"] = truncate_to_tokens(item["description"], MAX_DESCRIPTION_TOKENS)
+        if isinstance(item.get("resoFacts"), dict):
+            item["resoFacts"] = {key: value for key, value in item["resoFacts"].items() if value not in ("N/A", None)}
+        if isinstance(item.get("schools"), list):
+            item["schools"] = [
+                {field: school[field] for field in SCHOOL_FIELDS if field in school} if isinstance(school, dict) else school
+                for school in item["schools"][:MAX_SCHOOLS]
+            ]
+        projected.append(item)
+    return projected
+
+
+def project_places(places: List[Dict]) -> List[Dict]:
+    """
+    Keep only the Places fields the local advisor answer needs.
+
+    :param places: List[Dict] - Results from local_advisor.search_google_places.
+    :return: List[Dict] - Projected copies of the places.
+    """
+    projected = []
+    for place in places:
+        item = {field: place[field] for field in PLACE_FIELDS if field in place}
+        if isinstance(item.get("opening_hours"), dict):
+            item["opening_hours"] = {"open_now": item["opening_hours"].get("open_now")}
+        if isinstance(item.get("types"), list):
+            item["types"] = item["types"][:MAX_PLACE_TYPES]
+        projected.append(item)
+    return projected
+
+
+def fit_section(name: str, text: str) -> Tuple[str, int]:
+    """
+    Apply the section's token budget to a text section by cutting its tail. The text is counted
+    once, and counted again only if it had to be cut.
+
+    :param name: str - Section (placeholder) name, e.g. "CONTEXT".
+    :param text: str - The section text.
+    :return: Tuple[str, int] - The text, truncated to the budget, and its token count.
+    """
+    tokens = estimate_tokens(text)
+    budget = SECTION_BUDGETS.get(name)
+    if budget is None or tokens <= budget:
+        return text, tokens
+    text = truncate_to_tokens(text, budget, tokens=tokens)
+    return text, estimate_tokens(text)
+
+
+def fit_items(name: str, items: list, render: Callable[[list], str]) -> Tuple[str, int]:
+    """
+    Apply the section's token budget to a list section: drop items from the end (keeping at least
+    one), then cut the tail if the single remaining item is still over the budget.
+
+    :param name: str - Section (placeholder) name, e.g. "PLACES".
+    :param items: list - Items of the section, most important first.
+    :param render: Callable[[list], str] - Renders a list of items to the section text.
+    :return: Tuple[str, int] - The rendered section within the budget and its token count, for render_prompt.
+    """
+    text = render(items)
+    tokens = estimate_tokens(text)
+    budget = SECTION_BUDGETS.get(name)
+    if budget is None or tokens <= budget:
+        return text, tokens
+    for n in range(len(items) - 1, 0, -1):
+        text = render(items[:n])
+        tokens = estimate_tokens(text)
+        if tokens <= budget:
+            print(f"Prompt section {name}: kept {n} of {len(items)} items to fit {budget} tokens")
+            return text, tokens
+    text = truncate_to_tokens(text, budget, tokens=tokens)
+    return text, estimate_tokens(text)
+
+
+# Intent each prompt is built for ("routing" for the classification prompts)
+PROMPT_INTENTS = {
+    "classifier": "routing",
+    "route_extract": "routing",
+    "apifilter": "1",
+    "property": "1",
+    "local_advisor": "2",
+    "local_advisor_response": "2",
+    "rest_category": "2",
+    "rewrite_query": "3",
+    "rag_international": "3",
+    "general": "9",
+}
+HISTOGRAM_EDGES = [256, 512, 1024, 2048, 4096, 8192, 16384]
+EXPORT_EVERY = 20
+EXPORT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'metrics', 'prompt_tokens.json')
+
+_stats_lock = threading.Lock()
+_token_stats = {}
+_recorded_prompts = 0
+
+
+def _bucket_label(tokens: int) -> str:
+    for edge in HISTOGRAM_EDGES:
+        if tokens <= edge:
+            return f"<={edge}"
+    return f">{HISTOGRAM_EDGES[-1]}"
+
+
+def record_prompt_tokens(prompt_name: str, section_tokens: Dict[str, int], template_tokens: int):
+    """
+    Records the estimated token count of a rendered prompt and of each of its sections.
+
+    :param prompt_name: str - Prompt builder name, e.g. "property" (see PROMPT_INTENTS).
+    :param section_tokens: Dict[str, int] - Estimated tokens per filled placeholder.
+    :param template_tokens: int - Estimated tokens of the instruction text itself.
+    """
+    global _recorded_prompts
+    total = template_tokens + sum(section_tokens.values())
+    intent = PROMPT_INTENTS.get(prompt_name, "other")
+
+    with _stats_lock:
+        stats = _token_stats.setdefault(intent, {
+            "prompts": 0,
+            "total_tokens": 0,
+            "histogram": {_bucket_label(edge): 0 for edge in HISTOGRAM_EDGES + [HISTOGRAM_EDGES[-1] + 1]},
+            "sections": {},
+        })
+        stats["prompts"] += 1
+        stats["total_tokens"] += total
+        stats["histogram"][_bucket_label(total)] += 1
+        for section, tokens in [("TEMPLATE", template_tokens)] + list(section_tokens.items()):
+            section_stats = stats["sections"].setdefault(section, {"count": 0, "total_tokens": 0, "max_tokens": 0})
+            section_stats["count"] += 1
+            section_stats["total_tokens"] += tokens
+            section_stats["max_tokens"] = max(section_stats["max_tokens"], tokens)
+        _recorded_prompts += 1
+        export_now = _recorded_prompts % EXPORT_EVERY == 0
+
+    print(f"Prompt tokens ({prompt_name}): {total} total, sections {section_tokens}")
+    if export_now:
+        export_token_histograms()
+
+
+def get_token_histograms() -> Dict:
+    """
+    Returns the per-intent prompt token statistics collected since the process started.
+
+    :return: Dict - Per intent: prompt count, average and total tokens, a histogram of prompt sizes and per-section totals.
+    """
+    with _stats_lock:
+        stats = json.loads(json.dumps(_token_stats))
+    for intent_stats in stats.values():
+        intent_stats["average_tokens"] = intent_stats["total_tokens"] / intent_stats["prompts"]
+    return stats
+
+
+def export_token_histograms(path: Optional[str] = None) -> str:
+    """
+    Writes the per-intent prompt token statistics to a JSON file.
+
+    :param path: Optional[str] - Destination file (default: data/metrics/prompt_tokens.json next to this file).
+    :return: str - The path written.
+    """
+    path = path or EXPORT_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # One temporary file per process and thread, so concurrent exports never write the same file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(get_token_histograms(), f, indent=2)
+    os.replace(tmp_path, path)
+    return path
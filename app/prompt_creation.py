@@ -1,4 +1,103 @@
 import os
+import re
+from prompt_budget import estimate_tokens, fit_items, fit_section, project_places, project_properties, record_prompt_tokens
+
+# Placeholders are upper-case names in braces, so JSON examples like {"intent": 1} are left alone
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Z][A-Z_]*)\}")
+
+# Placeholders each instruction file must contain, checked when the prompts are loaded
+EXPECTED_PLACEHOLDERS = {
+    "instruction_apifilter": {"USER_QUERY", "LOCATIONS_STRING"},
+    "instruction_classifier": {"USER_QUERY"},
+    "instruction_general": {"USER_PROFILE", "USER_QUERY"},
+    "instruction_local_advisor": {"USER_QUERY"},
+    "instruction_local_advisor_response": {"USER_QUERY", "PLACES", "USER_PROFILE"},
+    "instruction_property_final": {"USER_QUERY", "PROPERTY_INFO", "USER_PROFILE"},
+    "instruction_rag_international": {"CONTEXT", "USER_QUERY", "USER_PROFILE"},
+    "instruction_rag_neighborhood": {"CONTEXT", "USER_QUERY"},
+    "instruction_rest_category": {"CATEGORIES_STRING"},
+    "instruction_rewrite_query": {"USER_QUERY"},
+    "instruction_route_extract": {"USER_QUERY", "LOCATIONS_STRING", "PLACE_TYPES"},
+}
+
+
+class PromptTemplate:
+    """
+    Prompt template parsed once into literal text and placeholder names.
+
+    Rendering fills every placeholder in a single pass and joins the pieces once, instead of
+    copying the whole instruction for every str.replace. Substituted values are never scanned
+    again, so a user query containing "{CONTEXT}" stays literal text.
+    """
+
+    def __init__(self, text: str, name: str = "prompt"):
+        """
+        :param text: str - The template text with {PLACEHOLDER} markers.
+        :param name: str - Template name used in error messages (default: "prompt").
+        """
+        self.name = name
+        parts = PLACEHOLDER_PATTERN.split(text)
+        # split alternates literal, placeholder, literal, ..., literal
+        self.literals = parts[0::2]
+        self.fields = parts[1::2]
+        self.placeholders = frozenset(self.fields)
+        self.template_tokens = estimate_tokens("".join(self.literals))
+
+    def validate(self, expected):
+        """
+        Checks that the template contains exactly the expected placeholders.
+
+        :param expected: set - Placeholder names the template must contain.
+        :raises ValueError: If placeholders are unknown or missing.
+        """
+        unknown = self.placeholders - set(expected)
+        missing = set(expected) - self.placeholders
+        if unknown or missing:
+            raise ValueError(f"Prompt {self.name}: unknown placeholders {sorted(unknown)}, missing placeholders {sorted(missing)}")
+
+    def render(self, **values) -> str:
+        """
+        Fills the placeholders. Values for placeholders the template doesn't contain are ignored.
+
+        :param values: str - Text for each placeholder, by name.
+        :return: str - The rendered prompt.
+        """
+        pieces = [self.literals[0]]
+        try:
+            for field, literal in zip(self.fields, self.literals[1:]):
+                pieces.append(values[field])
+                pieces.append(literal)
+        except KeyError as e:
+            raise ValueError(f"Prompt {self.name}: no value for placeholder {e.args[0]}") from None
+        return "".join(pieces)
+
+
+# Compiled templates by text, so callers passing the instruction string reuse the parsed form
+_templates = {}
+
+
+def get_template(instruction: str) -> PromptTemplate:
+    """
+    Returns the compiled template of an instruction, parsing it on first use.
+
+    :param instruction: str - The instruction template text.
+    :return: PromptTemplate - The compiled template.
+    """
+    template = _templates.get(instruction)
+    if template is None:
+        template = PromptTemplate(instruction)
+        _templates[instruction] = template
+    return template
+
+
+def format_user_profile(user_profile) -> str:
+    """
+    Renders the user profile block of the prompts.
+
+    :param user_profile: dict - The user's profile information.
+    :return: str - One "key: value" line per profile field.
+    """
+    return "\n".join([f"{key}: {value}" for key, value in user_profile.items()])
 
 
 def load_prompts(folder_path):
@@ -6,6 +105,9 @@ def load_prompts(folder_path):
     Reads all .txt files in the specified folder and stores their content in variables
     named after the files (excluding the .txt extension).
 
+    Instruction templates are compiled once here and their placeholders are checked against
+    EXPECTED_PLACEHOLDERS, so a broken prompt file fails at startup instead of mid-conversation.
+
     :param folder_path: str - The path to the folder containing the .txt files.
     :return: dict - A dictionary where keys are file names without .txt extension and values are the content of the files.
     """
@@ -17,9 +119,36 @@ def load_prompts(folder_path):
             with open(os.path.join(folder_path, filename), "r", encoding="utf-8") as file:
                 file_contents[variable_name] = file.read()
 
+    for name, expected in EXPECTED_PLACEHOLDERS.items():
+        if name in file_contents:
+            template = PromptTemplate(file_contents[name], name)
+            template.validate(expected)
+            _templates[file_contents[name]] = template
+
     return file_contents
 
 
+def render_prompt(prompt_name, instruction, **sections):
+    """
+    Renders a prompt with every section held to its token budget, and records its token counts.
+
+    Each section is tokenized once, the count serves both the budget and the statistics.
+    Sections the template doesn't contain are ignored and not counted.
+
+    :param prompt_name: str - Name of the prompt builder, used to group the token statistics by intent.
+    :param instruction: str - The instruction template.
+    :param sections: str - Text for each placeholder, by name, or the (text, tokens) pair fit_items returns.
+    :return: str - The rendered prompt.
+    """
+    template = get_template(instruction)
+    texts, section_tokens = {}, {}
+    for name, value in sections.items():
+        if name in template.placeholders:
+            texts[name], section_tokens[name] = value if isinstance(value, tuple) else fit_section(name, value)
+    record_prompt_tokens(prompt_name, section_tokens, template.template_tokens)
+    return template.render(**texts)
+
+
 def generate_prompt_classifier(instruction, user_query):
     """
     Generates a prompt for a classification task by replacing the user query placeholder.
@@ -28,7 +157,26 @@ def generate_prompt_classifier(instruction, user_query):
     :param user_query: str - The user's original query.
     :return: str - The updated instruction with the {USER_QUERY} placeholder replaced by the user's query.
     """
-    return instruction.replace("{USER_QUERY}", user_query)
+    return render_prompt("classifier", instruction, USER_QUERY=user_query)
+
+
+def generate_prompt_route_extract(instruction, user_query, locations_string, place_types):
+    """
+    Generates a prompt that classifies the query and extracts the search parameters in one call.
+
+    :param instruction: str - The instruction template containing placeholders for user query, locations and place types.
+    :param user_query: str - The user's original query.
+    :param locations_string: str - The formatted string of locations to replace the {LOCATIONS_STRING} placeholder.
+    :param place_types: str - The list of Google Places types to replace the {PLACE_TYPES} placeholder.
+    :return: str - The updated instruction with all placeholders replaced.
+    """
+    return render_prompt(
+        "route_extract",
+        instruction,
+        USER_QUERY=user_query,
+        LOCATIONS_STRING=locations_string,
+        PLACE_TYPES=place_types
+    )
 
 
 def generate_prompt_property(instruction, user_query, property_info, user_profile):
@@ -41,12 +189,18 @@ def generate_prompt_property(instruction, user_query, property_info, user_profil
     :param user_profile: dict - The user's profile information to include in the response.
     :return: str - The updated instruction with the placeholders replaced by the user query, property info, and key fields.
     """
-    user_profile_str = "\n".join([f"{key}: {value}" for key, value in user_profile.items()])
-
-    updated_instruction = instruction.replace("{USER_QUERY}", user_query)
-    updated_instruction = updated_instruction.replace("{PROPERTY_INFO}", str(property_info))
-    updated_instruction = updated_instruction.replace("{USER_PROFILE}", user_profile_str)
-    return updated_instruction
+    # Only the listing fields the answer uses, dropping trailing listings if still over budget
+    if isinstance(property_info, list):
+        property_section = fit_items("PROPERTY_INFO", project_properties(property_info), str)
+    else:
+        property_section = str(property_info)
+    return render_prompt(
+        "property",
+        instruction,
+        USER_QUERY=user_query,
+        PROPERTY_INFO=property_section,
+        USER_PROFILE=format_user_profile(user_profile)
+    )
 
 
 def generate_prompt_apifilter(instruction, user_query, locations_string):
@@ -58,9 +212,7 @@ def generate_prompt_apifilter(instruction, user_query, locations_string):
     :param locations_string: str - The formatted string of locations to replace the {LOCATIONS_STRING} placeholder.
     :return: str - The updated instruction with both placeholders replaced.
     """
-    zillow_prompt = instruction.replace("{USER_QUERY}", user_query)
-    zillow_prompt = zillow_prompt.replace("{LOCATIONS_STRING}", locations_string)
-    return zillow_prompt
+    return render_prompt("apifilter", instruction, USER_QUERY=user_query, LOCATIONS_STRING=locations_string)
 
 
 def generate_prompt_rest_category(output_instructions, user_query, categories):
@@ -72,9 +224,7 @@ def generate_prompt_rest_category(output_instructions, user_query, categories):
     :return: str - The updated instruction with the user query and categories inserted.
     """
     categories_string = ','.join(categories)
-    updated_instruction = output_instructions.replace("{USER_QUERY}", user_query)
-    updated_instruction = updated_instruction.replace("{CATEGORIES_STRING}", categories_string)
-    return updated_instruction
+    return render_prompt("rest_category", output_instructions, USER_QUERY=user_query, CATEGORIES_STRING=categories_string)
 
 
 def generate_prompt_rag_international(instruction, context, user_query, user_profile):
@@ -87,13 +237,13 @@ def generate_prompt_rag_international(instruction, context, user_query, user_pro
     :param user_query: dict - User profile information
     :return: str - The updated instruction with the context and user query inserted.
     """
-
-    user_profile_str = "\n".join([f"{key}: {value}" for key, value in user_profile.items()])
-    instruction = instruction.replace("{USER_PROFILE}", user_profile_str)
-
-    instruction = instruction.replace("{CONTEXT}", context)
-    instruction = instruction.replace("{USER_QUERY}", user_query)
-    return instruction 
+    return render_prompt(
+        "rag_international",
+        instruction,
+        USER_PROFILE=format_user_profile(user_profile),
+        CONTEXT=context,
+        USER_QUERY=user_query
+    )
 
 
 def generate_prompt_rewrite_query(instructions, user_query):
@@ -104,8 +254,7 @@ def generate_prompt_rewrite_query(instructions, user_query):
     :param user_query: str - The user's original query.
     :return: str - The updated instruction with the {USER_QUERY} placeholder replaced.
     """
-    updated_instruction = instructions.replace("{USER_QUERY}", user_query)
-    return updated_instruction
+    return render_prompt("rewrite_query", instructions, USER_QUERY=user_query)
 
 
 def generate_prompt_local_advisor(instruction, user_query):
@@ -116,7 +265,7 @@ def generate_prompt_local_advisor(instruction, user_query):
     :param user_query: str - The user's current query.
     :return: str - The instruction with the placeholder replaced by the user's query.
     """
-    return instruction.replace("{USER_QUERY}", user_query)
+    return render_prompt("local_advisor", instruction, USER_QUERY=user_query)
 
 
 def generate_prompt_local_advisor_response(instruction, user_query, places, user_profile):
@@ -130,23 +279,26 @@ def generate_prompt_local_advisor_response(instruction, user_query, places, user
     :return: str - The prompt for the LLM.
     """
     # Convert the places list to a detailed string for inclusion in the prompt
-    places_str = "\n".join(
-        [
-            f"Place {i+1}:\n" + "\n".join([f"  {key}: {value}" for key, value in place.items()])
-            for i, place in enumerate(places[:5])  # Limit to 5 places
-        ]
+    def format_places(items):
+        return "\n".join(
+            [
+                f"Place {i+1}:\n" + "\n".join([f"  {key}: {value}" for key, value in place.items()])
+                for i, place in enumerate(items)
+            ]
+        )
+
+    # Limit to 5 places and to the fields the answer uses (no photos, attributions or geometry)
+    places_section = fit_items("PLACES", project_places(places[:5]), format_places)
+
+    # Fill the placeholders in the instruction
+    return render_prompt(
+        "local_advisor_response",
+        instruction,
+        USER_QUERY=user_query,
+        PLACES=places_section,
+        USER_PROFILE=format_user_profile(user_profile)
     )
 
-    # Include user profile information in the prompt
-    user_profile_str = "\n".join([f"{key}: {value}" for key, value in user_profile.items()])
-
-    # Replace placeholders in the instruction
-    prompt = instruction.replace("{USER_QUERY}", user_query)
-    prompt = prompt.replace("{PLACES}", places_str)
-    prompt = prompt.replace("{USER_PROFILE}", user_profile_str)
-
-    return prompt
-
 
 def generate_prompt_general(instruction, user_query, user_profile):
     """
@@ -157,7 +309,9 @@ def generate_prompt_general(instruction, user_query, user_profile):
     :param user_profile: dict - User profile information to include in the response.
     :return: str - The updated instruction with the user query and user profile inserted.
     """
-    user_profile_str = "\n".join([f"{key}: {value}" for key, value in user_profile.items()])
-    instruction = instruction.replace("{USER_PROFILE}", user_profile_str)
-    instruction = instruction.replace("{USER_QUERY}", user_query)
-    return instruction
+    return render_prompt(
+        "general",
+        instruction,
+        USER_PROFILE=format_user_profile(user_profile),
+        USER_QUERY=user_query
+    )
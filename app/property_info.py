@@ -1,8 +1,11 @@
 import json
 import requests
 import os
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from cache import create_cache, make_cache_key
 
 env_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path=env_path)
@@ -16,6 +19,27 @@ headers = {
     "X-RapidAPI-Host": "zillow-com1.p.rapidapi.com"
 }
 
+# RapidAPI enforces a per-second request limit: rate-limited requests are retried with backoff
+# (honouring Retry-After) and concurrent detail requests are capped at the plan's rate
+ZILLOW_MAX_CONCURRENCY = int(os.getenv("ZILLOW_MAX_CONCURRENCY", 2))
+retry_policy = Retry(
+    total=4,
+    status_forcelist=[429, 502, 503, 504],
+    allowed_methods=["GET"],
+    backoff_factor=0.5,
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+# Pooled session so search and detail requests reuse connections to the API host
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry_policy))
+
+# Two-level response cache: search results keyed by the normalized api_filter, detail payloads by detailUrl.
+# Set CACHE_BACKEND=sqlite to keep entries across restarts.
+search_cache = create_cache('zillow_search', max_size=256, ttl=int(os.getenv("ZILLOW_SEARCH_CACHE_TTL", 15 * 60)))
+detail_cache = create_cache('zillow_detail', max_size=1024, ttl=int(os.getenv("ZILLOW_DETAIL_CACHE_TTL", 6 * 60 * 60)))
+
 
 def extract_json_to_dict(text):
     """
@@ -121,75 +145,59 @@ def extract_properties(response, n=5):
         return []
 
 
-def fetch_descriptions(properties, headers=headers, url_details=url_details):
-    """
-    Fetches and appends property descriptions from the API to the property list.
-
-    :param properties: list - A list of dictionaries representing properties.
-    :return: list - The updated list of properties with descriptions included.
-    """
-    for prop in properties:
-        # Fetch detailed information using detailUrl
-        querystring = {"property_url": prop['detailUrl']}
-        response = requests.get(url_details, headers=headers, params=querystring)
-
-        # Convert to JSON and fetch description
-        detail_data = response.json()
-        prop['description'] = detail_data.get('description', 'No description available')
-
-    return properties
-
-
-def fetch_resoFacts(properties, keys_to_fetch, headers=headers):
+def fetch_property_detail(prop, session=session, headers=headers, url_details=url_details, timeout=10):
     """
-    Fetches specific fields from the resoFacts section of each property and appends them.
+    Fetches the detail payload of a single property from the cache or the API.
 
-    :param properties: list - A list of dictionaries representing properties.
+    :param prop: dict - A dictionary representing a property, must contain 'detailUrl'.
+    :param session: requests.Session - Pooled session used for the request.
     :param headers: dict - HTTP headers for the API request.
-    :param keys_to_fetch: list - The specific keys to extract from the resoFacts dictionary.
-    :return: list - The updated list of properties with the resoFacts information appended.
+    :param url_details: str - The property detail endpoint URL.
+    :param timeout: int - Timeout in seconds for the request (default: 10).
+    :return: dict - The detail payload, or an empty dict if the request failed.
     """
-    url_details = "https://zillow-com1.p.rapidapi.com/property"
+    cached = detail_cache.get(prop['detailUrl'])
+    if cached is not None:
+        return cached
 
-    for prop in properties:
-        # Fetch detailed information using detailUrl
+    try:
         querystring = {"property_url": prop['detailUrl']}
-        response = requests.get(url_details, headers=headers, params=querystring)
+        response = session.get(url_details, headers=headers, params=querystring, timeout=timeout)
+        response.raise_for_status()
         detail_data = response.json()
-
-        # Fetch information from the resoFacts dictionary
-        resoFacts = detail_data.get('resoFacts', {})
-
-        # Create a nested dictionary to store resoFacts information
-        prop['resoFacts'] = {}
-
-        for key in keys_to_fetch:
-            prop['resoFacts'][key] = resoFacts.get(key, 'N/A')
-
-    return properties
+        detail_cache.set(prop['detailUrl'], detail_data)
+        return detail_data
+    except Exception as e:
+        print(f"Error fetching details for {prop.get('detailUrl')}: {e}")
+        return {}
 
 
-def fetch_schools(properties, headers=headers):
+def fetch_property_details(properties, keys_to_fetch, session=session, headers=headers, max_workers=ZILLOW_MAX_CONCURRENCY):
     """
-    Fetches school information for each property and appends it to the list.
+    Fetches the detail payload of every property concurrently, one request per property,
+    and appends the description, selected resoFacts fields and nearby schools to each property.
 
     :param properties: list - A list of dictionaries representing properties.
+    :param keys_to_fetch: list - The specific keys to extract from the resoFacts dictionary.
+    :param session: requests.Session - Pooled session shared by the concurrent requests.
     :param headers: dict - HTTP headers for the API request.
-    :return: list - The updated list of properties with nearby school information included.
+    :param max_workers: int - Maximum number of concurrent detail requests (default: ZILLOW_MAX_CONCURRENCY).
+    :return: list - The updated list of properties with description, resoFacts and schools included.
     """
-    url_details = "https://zillow-com1.p.rapidapi.com/property"
+    if not properties:
+        return properties
 
-    for prop in properties:
-        # Fetch detailed information using detailUrl
-        querystring = {"property_url": prop['detailUrl']}
-        response = requests.get(url_details, headers=headers, params=querystring)
-        detail_data = response.json()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(properties))) as executor:
+        details = list(executor.map(lambda prop: fetch_property_detail(prop, session, headers), properties))
 
-        # Fetch schools information
-        schools = detail_data.get('schools', [])
+    for prop, detail_data in zip(properties, details):
+        prop['description'] = detail_data.get('description', 'No description available')
+
+        # Create a nested dictionary to store resoFacts information
+        resoFacts = detail_data.get('resoFacts') or {}
+        prop['resoFacts'] = {key: resoFacts.get(key, 'N/A') for key in keys_to_fetch}
 
-        # Create a nested dictionary to store school information
-        prop['schools'] = schools
+        prop['schools'] = detail_data.get('schools', [])
 
     return properties
 
@@ -203,23 +211,25 @@ def fetch_top_properties_detail(api_filter, url=url, headers=headers):
     :param headers: dict - HTTP headers containing authentication and other details.
     :return: list - A list of top properties with detailed information, including descriptions, resoFacts, and school info.
     """
-    response = requests.get(url, headers = headers, params = api_filter)
-    
-    # get top 5 listings(sorted by newest)
-    top_properties = extract_properties(response)
-    
-    # get description of the properties
-    top_properties = fetch_descriptions(top_properties)
-
-    # get resoFacts(detail) of the properties
+    # get top 5 listings(sorted by newest), reusing a cached search for the same filter
+    cache_key = make_cache_key(api_filter) if isinstance(api_filter, dict) else None
+    search_data = search_cache.get(cache_key) if cache_key else None
+    if search_data is None:
+        response = session.get(url, headers = headers, params = api_filter)
+        if not response.ok:
+            return extract_properties(response)
+        search_data = response.json()
+        if cache_key:
+            search_cache.set(cache_key, search_data)
+
+    top_properties = extract_properties(search_data)
+
+    # get description, resoFacts(detail) and school info of the properties from one detail request each
     keys_to_fetch_resoFacts = [
         'hasGarage', 'hasPetsAllowed', 'heating', 'cooling', 'flooring', 'appliances',
         'laundryFeatures', 'associationFee',
         'livingArea', 'taxAnnualAmount', 'parkingFeatures', 'stories'
     ]
-    top_properties = fetch_resoFacts(top_properties, keys_to_fetch_resoFacts)
-
-    # get school info of the properties
-    top_properties = fetch_schools(top_properties, headers)
+    top_properties = fetch_property_details(top_properties, keys_to_fetch_resoFacts, headers=headers)
     
-    return top_properties
\ No newline at end of file
+    return top_properties
@@ -1,21 +1,55 @@
 import os
+import threading
+from types import MappingProxyType
+import faiss
 import pandas as pd
 from llm import start_chat_session
 from prompt_creation import load_prompts
 from vector_search import load_vectordb
 
-def setup():
-    # Setup file path
-    base_dir = os.path.dirname(__file__)
-    prompts_path = os.path.join(base_dir, 'prompts')
-    vectordb_path = os.path.join(base_dir, 'data', 'vectordb')
+# Resources shared read-only by every Streamlit session in this process
+_shared_lock = threading.Lock()
+_shared_resources = None
+
+
+def load_shared_resources():
+    """
+    Loads the prompts and the vector store (with its embeddings client) once per process.
+
+    The result is shared by all sessions and must be treated as read-only: prompts are returned
+    as a read-only mapping and nothing adds to or removes from the vector store after loading.
+    FAISS CPU indexes support concurrent searches from several threads as long as nobody writes
+    to them, so sessions search the shared store without a lock. FAISS's own OpenMP threads are
+    limited to one so concurrent sessions don't oversubscribe the CPU.
+
+    :return: tuple - The read-only prompts mapping and the shared FAISS vector store.
+    """
+    global _shared_resources
 
-    # Chat setup
+    # Double-checked locking so concurrent first sessions load only once
+    if _shared_resources is None:
+        with _shared_lock:
+            if _shared_resources is None:
+                base_dir = os.path.dirname(__file__)
+                prompts_path = os.path.join(base_dir, 'prompts')
+                vectordb_path = os.path.join(base_dir, 'data', 'vectordb')
+
+                faiss.omp_set_num_threads(1)
+                prompts_dict = MappingProxyType(load_prompts(prompts_path))
+                vectordb = load_vectordb(vectordb_path)
+                if vectordb is None:
+                    # Don't keep a failed load, the next session retries
+                    return prompts_dict, vectordb
+                _shared_resources = (prompts_dict, vectordb)
+
+    return _shared_resources
+
+
+def setup():
+    # Chat setup, every session gets its own chat history
     chat = start_chat_session()
-    # Load prompts
-    prompts_dict = load_prompts(prompts_path)
-    # Load vector store
-    vectordb = load_vectordb(vectordb_path)
+    # Prompts and vector store are loaded once per process and shared
+    prompts_dict, vectordb = load_shared_resources()
 
     return chat, prompts_dict, vectordb
 
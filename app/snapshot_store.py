@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class SnapshotStore:
+    """
+    Content-addressed store of raw fetched pages.
+
+    Page bodies are stored gzip-compressed under objects/, named by the SHA-256 of the HTML,
+    so identical pages are stored once. A small JSON record per URL under refs/ points to the
+    latest body together with its response headers and fetch time. All writes go through a
+    temporary file and os.replace, so concurrent fetch threads never see partial files.
+    """
+
+    # Response headers kept with each snapshot
+    KEPT_HEADERS = ("ETag", "Last-Modified", "Content-Type", "Date")
+
+    def __init__(self, root: str):
+        """
+        :param root: str - Folder of the store.
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.refs_dir = os.path.join(root, "refs")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.refs_dir, exist_ok=True)
+
+    def _object_path(self, content_hash: str) -> str:
+        return os.path.join(self.objects_dir, content_hash[:2], content_hash[2:] + ".html.gz")
+
+    def _ref_path(self, url: str) -> str:
+        return os.path.join(self.refs_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get_record(self, url: str) -> Optional[Dict]:
+        """
+        Get the snapshot record of a URL.
+
+        :param url: str - The page URL.
+        :return: Optional[Dict] - The record with sha256, fetched_at and headers, or None if the URL was never stored.
+        """
+        ref_path = self._ref_path(url)
+        if not os.path.exists(ref_path):
+            return None
+        with open(ref_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def get(self, url: str, max_age: Optional[float] = None) -> Optional[Tuple[str, Dict]]:
+        """
+        Get the stored HTML of a URL if it is fresh enough.
+
+        :param url: str - The page URL.
+        :param max_age: Optional[float] - Maximum snapshot age in seconds (None to accept any age).
+        :return: Optional[Tuple[str, Dict]] - The HTML and its record, or None if missing or stale.
+        """
+        record = self.get_record(url)
+        if record is None:
+            return None
+        if max_age is not None and time.time() - record["fetched_at"] > max_age:
+            return None
+        object_path = self._object_path(record["sha256"])
+        if not os.path.exists(object_path):
+            return None
+        with gzip.open(object_path, "rb") as f:
+            return f.read().decode("utf-8"), record
+
+    def put(self, url: str, html_content: str, headers: Optional[Dict] = None) -> str:
+        """
+        Store the HTML of a URL and point the URL's record to it.
+
+        :param url: str - The page URL.
+        :param html_content: str - The raw HTML.
+        :param headers: Optional[Dict] - Response headers, only KEPT_HEADERS are stored.
+        :return: str - The content hash of the stored HTML.
+        """
+        data = html_content.encode("utf-8")
+        content_hash = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(content_hash)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, gzip.compress(data))
+
+        headers = headers or {}
+        record = {
+            "url": url,
+            "sha256": content_hash,
+            "fetched_at": time.time(),
+            "headers": {name: headers[name] for name in self.KEPT_HEADERS if name in headers},
+        }
+        self._write_atomic(self._ref_path(url), json.dumps(record).encode("utf-8"))
+        return content_hash
+
+    def urls(self) -> List[str]:
+        """
+        List every URL with a snapshot.
+
+        :return: List[str] - The stored URLs.
+        """
+        urls = []
+        for filename in os.listdir(self.refs_dir):
+            if filename.endswith(".json"):
+                with open(os.path.join(self.refs_dir, filename), "r", encoding="utf-8") as f:
+                    urls.append(json.load(f)["url"])
+        return urls
@@ -0,0 +1,24 @@
+from langchain.schema import Document
+
+from vector_search import pack_chunks
+
+
+def _chunk(content, chunk_index):
+    return Document(page_content=content, metadata={"source": "https://example.edu/visa", "chunk_index": chunk_index})
+
+
+def test_pack_chunks_trims_overlap():
+    first = "Students on an F-1 visa must keep a valid I-20 and enroll full time every term."
+    second = "keep a valid I-20 and enroll full time every term. Report address changes within 10 days."
+    packed = pack_chunks([_chunk(first, 0), _chunk(second, 1)])
+    assert len(packed) == 1
+    assert packed[0].page_content == first + " Report address changes within 10 days."
+    assert packed[0].metadata["chunk_index"] == "0-1"
+
+
+def test_pack_chunks_separates_chunks_without_overlap():
+    first = "Students on an F-1 visa must keep a valid I-20 and enroll full time every term."
+    second = "Next, report any change of address to the international office within 10 days."
+    packed = pack_chunks([_chunk(first, 0), _chunk(second, 1)])
+    assert len(packed) == 1
+    assert packed[0].page_content == first + "\n" + second
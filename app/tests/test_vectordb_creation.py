@@ -0,0 +1,18 @@
+import random
+
+from vectordb_creation import ChunkDeduplicator, NEAR_DUPLICATE_MAX_HAMMING
+
+
+def test_band_probing_finds_every_near_duplicate():
+    rng = random.Random(0)
+    deduplicator = ChunkDeduplicator()
+    fingerprints = [rng.getrandbits(64) for _ in range(200)]
+    for i, fingerprint in enumerate(fingerprints):
+        deduplicator.remember(f"hash-{i}", fingerprint)
+
+    for _ in range(2000):
+        fingerprint = rng.choice(fingerprints)
+        near = fingerprint
+        for bit in rng.sample(range(64), rng.randint(0, NEAR_DUPLICATE_MAX_HAMMING)):
+            near ^= 1 << bit
+        assert fingerprint in deduplicator._candidates(near)
@@ -1,10 +1,19 @@
 from typing import List, Dict, Optional
 from langchain.schema import Document
+import json
 import os
+import sys
+import threading
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from dotenv import load_dotenv
-from langchain.load import dumps, loads
+from cache import MemoryCache, SQLiteCache
+from prompt_budget import estimate_tokens, truncate_to_tokens
+from langchain_community.vectorstores.utils import DistanceStrategy
+from vectordb_format import STORE_FILENAME, ShardedFAISS, is_vectorstore_dir, load_vectorstore, read_store_info
 
 
 load_dotenv()
@@ -12,23 +21,153 @@ openai_api_key = os.getenv('OPENAI_API_KEY')
 if not openai_api_key:
     raise ValueError("OpenAI API key not found in environment variables")
 
+# Query rewriting is only worth an LLM round trip when the original query retrieves poorly:
+# a weak best match, or a best match barely ahead of the k-th (no clear answer in the corpus).
+# Similarities are cosine similarities of the unit-length OpenAI embeddings. The thresholds come from
+# calibrate_rewrite_thresholds (python vector_search.py <queries file>), which measures them on real
+# queries against the shipped store; 0.45 and 0.02 are uncalibrated fallbacks until it has been run.
+# Environment variables override both.
+REWRITE_THRESHOLDS_PATH = os.path.join(os.path.dirname(__file__), 'data', 'rewrite_thresholds.json')
+_calibrated_thresholds = {}
+if os.path.exists(REWRITE_THRESHOLDS_PATH):
+    with open(REWRITE_THRESHOLDS_PATH, 'r', encoding='utf-8') as f:
+        _calibrated_thresholds = json.load(f)
+REWRITE_MIN_SIMILARITY = float(os.getenv('REWRITE_MIN_SIMILARITY', _calibrated_thresholds.get('min_similarity', 0.45)))
+REWRITE_MIN_MARGIN = float(os.getenv('REWRITE_MIN_MARGIN', _calibrated_thresholds.get('min_margin', 0.02)))
 
-def load_vectordb(load_path: str, model: str = "text-embedding-3-small") -> FAISS:
+_rewrite_stats_lock = threading.Lock()
+_rewrite_stats = {"skipped": 0, "rewritten": 0, "rewrite_seconds": 0.0}
+
+# The query-embedding cache statistics are logged every CACHE_STATS_EVERY searches, not on each one
+CACHE_STATS_EVERY = int(os.getenv('CACHE_STATS_EVERY', 50))
+_search_count_lock = threading.Lock()
+_search_count = 0
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated query vectors from an in-memory LRU cache backed by
+    an on-disk SQLite cache, and only calls the embedding API on a miss.
+    Keys are the embedding model name (with its dimensions if shortened) plus the whitespace- and
+    case-normalized text.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache_path: Optional[str] = None,
+                 max_size: int = 2048, ttl: Optional[float] = None):
+        """
+        :param embeddings: Embeddings - The underlying embedding model.
+        :param model: str - Embedding model name, part of every cache key.
+        :param cache_path: Optional[str] - Path of the SQLite cache file (None for memory only).
+        :param max_size: int - Maximum number of vectors kept in memory (default: 2048).
+        :param ttl: Optional[float] - Seconds a cached vector stays valid (default: None, no expiry).
+        """
+        self.embeddings = embeddings
+        self.model = model
+        self.memory_cache = MemoryCache(max_size=max_size, ttl=ttl)
+        self.disk_cache = SQLiteCache(cache_path, table='query_embeddings', max_size=max_size * 10, ttl=ttl) if cache_path else None
+        self._stats_lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _key(self, text: str) -> str:
+        return f"{self.model}:{' '.join(text.lower().split())}"
+
+    def _count(self, field: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[field] += n
+
+    def _get_cached(self, key: str) -> Optional[List[float]]:
+        vector = self.memory_cache.get(key)
+        if vector is not None:
+            self._count("memory_hits")
+            return vector
+        if self.disk_cache is not None:
+            vector = self.disk_cache.get(key)
+            if vector is not None:
+                self._count("disk_hits")
+                self.memory_cache.set(key, vector)
+                return vector
+        return None
+
+    def _set_cached(self, key: str, vector: List[float]):
+        self.memory_cache.set(key, vector)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, vector)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._get_cached(key)
+        if vector is None:
+            self._count("misses")
+            vector = self.embeddings.embed_query(text)
+            self._set_cached(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Look up every text, then embed all misses in a single API call
+        keys = [self._key(text) for text in texts]
+        vectors = [self._get_cached(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            self._count("misses", len(missing))
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+                self._set_cached(keys[i], vector)
+        return vectors
+
+    def get_stats(self) -> Dict:
+        """
+        Returns hit/miss counters and the overall hit rate.
+
+        :return: Dict - Memory hits, disk hits, misses and hit rate.
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        total = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / total if total else 0.0
+        return stats
+
+
+def load_vectordb(load_path: str,
+                  model: str = "text-embedding-3-small",
+                  cache_path: Optional[str] = None,
+                  allow_legacy_pickle: bool = False) -> FAISS:
     """
     Load FAISS vector database from disk using OpenAI embeddings.
 
+    Stores saved by vectordb_creation are memory-mapped and read chunks lazily from SQLite
+    (see vectordb_format); the embedding size recorded in the store is requested for queries. Legacy index.faiss + index.pkl folders require unpickling and are
+    only loaded when explicitly allowed; convert them with `python vectordb_format.py <folder>`.
+
     :param load_path: str - Path where the database is stored.
     :param model: str - OpenAI embedding model name (default: "text-embedding-3-small").
+    :param cache_path: Optional[str] - Path of the on-disk query-embedding cache (default: data/cache/embeddings.sqlite next to this file).
+    :param allow_legacy_pickle: bool - Whether to load a legacy pickled store (default: False).
     :return: FAISS - Vector store object.
     """
     try:
-        # Initialize OpenAI embedding model
-        embeddings = OpenAIEmbeddings(
-            openai_api_key=openai_api_key,
-            model=model
+        # Query vectors must have the (possibly shortened) size the store was built with
+        dimensions = None
+        if is_vectorstore_dir(load_path):
+            dimensions = read_store_info(load_path).get("embedding_dimensions")
+
+        # Initialize OpenAI embedding model, query vectors are cached
+        cache_path = cache_path or os.path.join(os.path.dirname(__file__), 'data', 'cache', 'embeddings.sqlite')
+        embeddings = CachedEmbeddings(
+            OpenAIEmbeddings(
+                openai_api_key=openai_api_key,
+                model=model,
+                dimensions=dimensions
+            ),
+            model=f"{model}@{dimensions}" if dimensions else model,
+            cache_path=cache_path
         )
         
         # Load vector store
+        if is_vectorstore_dir(load_path):
+            return load_vectorstore(load_path, embeddings)
+        if not allow_legacy_pickle:
+            raise ValueError(f"No {STORE_FILENAME} in {load_path}, convert the legacy store with vectordb_format.py")
         vectorstore = FAISS.load_local(
             folder_path=load_path,
             embeddings=embeddings,
@@ -40,10 +179,27 @@ def load_vectordb(load_path: str, model: str = "text-embedding-3-small") -> FAIS
         return None
 
 
+def _log_cache_stats(embeddings: CachedEmbeddings):
+    """
+    Counts a search and prints the query-embedding cache statistics every CACHE_STATS_EVERY searches.
+
+    :param embeddings: CachedEmbeddings - The cached embedding function of the searched store.
+    """
+    global _search_count
+    with _search_count_lock:
+        _search_count += 1
+        log_now = _search_count % CACHE_STATS_EVERY == 0
+    if log_now:
+        print(f'Query embedding cache after {_search_count} searches:', embeddings.get_stats())
+
+
 def search_similar_chunks(vectorstore: FAISS,
                          query: str,
                          k: int = 5,
-                         filter_dict: Optional[Dict] = None) -> List[Document]:
+                         filter_dict: Optional[Dict] = None,
+                         mmr: bool = False,
+                         fetch_k: int = 20,
+                         lambda_mult: float = 0.5) -> List[Document]:
     """
     Search for similar chunks in the vector database.
 
@@ -51,10 +207,26 @@ def search_similar_chunks(vectorstore: FAISS,
     :param query: str - Search query string.
     :param k: int - Number of similar chunks to return (default: 5).
     :param filter_dict: Optional[Dict] - Optional metadata filters (e.g., {"source_type": "uchicago"}).
+    :param mmr: bool - Rerank a pool of fetch_k candidates for diversity with mmr_select (default: False).
+    :param fetch_k: int - Candidate pool size for MMR (default: 20).
+    :param lambda_mult: float - MMR trade-off, 1 for pure relevance and 0 for pure diversity (default: 0.5).
     :return: List[Document] - List of similar Document objects.
     """
     try:
-        if filter_dict:
+        if mmr and not filter_dict:
+            query_vector = np.asarray(vectorstore.embedding_function.embed_query(query), dtype=np.float32)
+            _, indices = vectorstore.index.search(query_vector[None, :], fetch_k)
+            rows = indices[0][indices[0] != -1]
+            similar_docs = lookup_documents(vectorstore, mmr_rerank_rows(vectorstore, query_vector, rows, k, lambda_mult))
+        elif mmr:
+            similar_docs = vectorstore.max_marginal_relevance_search(
+                query,
+                k=k,
+                fetch_k=fetch_k,
+                lambda_mult=lambda_mult,
+                filter=filter_dict
+            )
+        elif filter_dict:
             similar_docs = vectorstore.similarity_search(
                 query,
                 k=k,
@@ -65,6 +237,8 @@ def search_similar_chunks(vectorstore: FAISS,
                 query,
                 k=k
             )
+        if isinstance(vectorstore.embedding_function, CachedEmbeddings):
+            _log_cache_stats(vectorstore.embedding_function)
         return similar_docs
     
     except Exception as e:
@@ -72,10 +246,513 @@ def search_similar_chunks(vectorstore: FAISS,
         return []
 
 
+def expand_to_parents(vectorstore: FAISS, documents: List[Document]) -> List[Document]:
+    """
+    Replace child chunk hits with their parent sections for the prompt (parent-document retrieval).
+    Several hits in one parent yield that parent once, at the rank of its best hit. Chunks without
+    a parent (or stores built without child chunks) are returned unchanged.
+
+    :param vectorstore: FAISS - FAISS vector store instance, loaded with load_vectordb.
+    :param documents: List[Document] - Search hits, most relevant first.
+    :return: List[Document] - Parent sections and unchanged chunks, most relevant first.
+    """
+    parent_docstore = getattr(vectorstore, 'parent_docstore', None)
+    if parent_docstore is None:
+        return documents
+
+    expanded = []
+    seen_parents = set()
+    for doc in documents:
+        parent_id = doc.metadata.get('parent_id')
+        if parent_id is None:
+            expanded.append(doc)
+            continue
+        if parent_id in seen_parents:
+            continue
+        seen_parents.add(parent_id)
+        parent = parent_docstore.search(parent_id)
+        expanded.append(parent if isinstance(parent, Document) else doc)
+    return expanded
+
+
+def mmr_select(query_vector: np.ndarray, candidate_vectors: np.ndarray, k: int, lambda_mult: float = 0.5) -> np.ndarray:
+    """
+    Maximal marginal relevance selection: repeatedly pick the candidate with the best trade-off
+    between similarity to the query and dissimilarity to the candidates already picked.
+
+    Cosine similarities to the query and between all candidates are computed as two matrix
+    products up front, so each of the k picks is one vectorized update over the pool.
+
+    :param query_vector: np.ndarray - Query embedding of shape (dimension,).
+    :param candidate_vectors: np.ndarray - Candidate embeddings of shape (n, dimension), most relevant first.
+    :param k: int - Number of candidates to select.
+    :param lambda_mult: float - 1 for pure relevance, 0 for pure diversity (default: 0.5).
+    :return: np.ndarray - Positions of the selected candidates, in selection order.
+    """
+    n = len(candidate_vectors)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(min(k, n) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return np.asarray(selected)
+
+
+def mmr_rerank_rows(vectorstore: FAISS, query_vector: np.ndarray, rows, k: int, lambda_mult: float = 0.5) -> np.ndarray:
+    """
+    Rerank candidate FAISS rows with MMR, using the vectors stored in the index (no re-embedding).
+
+    :param vectorstore: FAISS - FAISS vector store instance.
+    :param query_vector: np.ndarray - Query embedding of shape (dimension,).
+    :param rows: np.ndarray - Candidate FAISS row ids, most relevant first.
+    :param k: int - Number of rows to keep.
+    :param lambda_mult: float - 1 for pure relevance, 0 for pure diversity (default: 0.5).
+    :return: np.ndarray - The selected row ids, in selection order.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    if len(rows) <= 1:
+        return rows[:k]
+    candidate_vectors = vectorstore.index.reconstruct_batch(rows)
+    return rows[mmr_select(query_vector, candidate_vectors, k, lambda_mult)]
+
+
+def lookup_documents(vectorstore: FAISS, faiss_ids) -> List[Document]:
+    """
+    Map FAISS row ids back to the stored Document objects.
+
+    :param vectorstore: FAISS - FAISS vector store instance.
+    :param faiss_ids: Iterable[int] - FAISS row ids, as returned by index.search.
+    :return: List[Document] - The matching Document objects, in the same order.
+    """
+    docs = []
+    for i in faiss_ids:
+        # FAISS pads with -1 when the index holds fewer than k vectors
+        if i == -1:
+            continue
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)])
+        if isinstance(doc, Document):
+            docs.append(doc)
+    return docs
+
+
+def _search_shards_batch(vectorstore: ShardedFAISS, shards: List[FAISS], query_vectors: np.ndarray, k: int) -> List[List[Document]]:
+    # Search every shard with the whole query matrix, then keep the k best rows per query across shards
+    if not shards:
+        return [[] for _ in query_vectors]
+    distances, documents = [], []
+    for shard in shards:
+        shard_distances, shard_indices = shard.index.search(query_vectors, min(k, shard.index.ntotal))
+        distances.append(shard_distances)
+        documents.append([[(shard, i) for i in row] for row in shard_indices])
+    distances = np.hstack(distances)
+    if vectorstore.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        distances = -distances
+    results = []
+    for q, order in enumerate(np.argsort(distances, axis=1, kind="stable")):
+        candidates = [hit for shard_hits in documents for hit in shard_hits[q]]
+        docs = []
+        for column in order[:k]:
+            shard, i = candidates[column]
+            docs.extend(lookup_documents(shard, [i]))
+        results.append(docs)
+    return results
+
+
+def search_similar_chunks_batch(vectorstore: FAISS,
+                                queries: List[str],
+                                k: int = 5,
+                                filter_dict: Optional[Dict] = None) -> List[List[Document]]:
+    """
+    Search for similar chunks for several queries at once. All queries are embedded in a single
+    embedding call and searched with one FAISS search over the stacked query matrix (one per
+    shard when the filter selects shards of a sharded store).
+
+    :param vectorstore: FAISS - FAISS vector store instance.
+    :param queries: List[str] - Search query strings (e.g., the original query and its rewrites).
+    :param k: int - Number of similar chunks to return per query (default: 5).
+    :param filter_dict: Optional[Dict] - Optional metadata filters (e.g., {"source_type": "uchicago"}).
+    :return: List[List[Document]] - One ranked list of similar Document objects per query.
+    """
+    if not queries:
+        return []
+
+    try:
+        query_vectors = np.asarray(vectorstore.embedding_function.embed_documents(queries), dtype=np.float32)
+        if vectorstore._normalize_L2:
+            faiss.normalize_L2(query_vectors)
+
+        # Filters on the shard field only search the matching shards, one batched search per shard
+        routed = vectorstore.route(filter_dict) if isinstance(vectorstore, ShardedFAISS) else None
+        if routed is not None and routed[1] is None:
+            return _search_shards_batch(vectorstore, routed[0], query_vectors, k)
+
+        # Other metadata filters need LangChain's over-fetch and post-filter, one query at a time
+        if filter_dict:
+            return [
+                vectorstore.similarity_search_by_vector(vector.tolist(), k=k, filter=filter_dict)
+                for vector in query_vectors
+            ]
+
+        _, indices = vectorstore.index.search(query_vectors, k)
+        return [lookup_documents(vectorstore, row) for row in indices]
+
+    except Exception as e:
+        print(f"Error during batched similarity search: {str(e)}")
+        return [[] for _ in queries]
+
+
+def confidence_from_scores(vectorstore: FAISS, scores: np.ndarray) -> Dict:
+    """
+    Turn the dense scores of a query's top chunks into its retrieval confidence.
+
+    :param vectorstore: FAISS - FAISS vector store instance the scores come from.
+    :param scores: np.ndarray - FAISS scores of the top k chunks, best first.
+    :return: Dict - Cosine similarity of the best chunk ("top_similarity") and its lead over the k-th ("margin").
+    """
+    if not len(scores):
+        return {"top_similarity": 0.0, "margin": 0.0}
+
+    # Squared L2 distance d between unit vectors is 2 - 2 * cosine
+    if vectorstore.distance_strategy != DistanceStrategy.MAX_INNER_PRODUCT:
+        scores = 1 - scores / 2
+    return {"top_similarity": float(scores[0]), "margin": float(scores[0] - scores[-1])}
+
+
+def retrieval_confidence(vectorstore: FAISS, query: str, k: int = 5) -> Dict:
+    """
+    Measure how well a query retrieves, from a dense search of the top k chunks.
+    hybrid_search returns the same measure from its own dense search with with_confidence=True,
+    this is for searches that don't go through it.
+
+    :param vectorstore: FAISS - FAISS vector store instance.
+    :param query: str - Search query string.
+    :param k: int - Number of chunks considered (default: 5).
+    :return: Dict - Cosine similarity of the best chunk ("top_similarity") and its lead over the k-th ("margin").
+    """
+    query_vector = np.asarray([vectorstore.embedding_function.embed_query(query)], dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(query_vector)
+    scores, indices = vectorstore.index.search(query_vector, k)
+    return confidence_from_scores(vectorstore, scores[0][indices[0] != -1])
+
+
+def needs_query_rewrite(confidence: Dict,
+                        min_similarity: float = REWRITE_MIN_SIMILARITY,
+                        min_margin: float = REWRITE_MIN_MARGIN) -> bool:
+    """
+    Decide whether the original query retrieved too weakly to answer without rewrites.
+
+    :param confidence: Dict - Output of retrieval_confidence.
+    :param min_similarity: float - Best-chunk similarity below which to rewrite (default: REWRITE_MIN_SIMILARITY).
+    :param min_margin: float - Top-1 vs top-k similarity lead below which to rewrite (default: REWRITE_MIN_MARGIN).
+    :return: bool - True if the query should be rewritten.
+    """
+    return confidence["top_similarity"] < min_similarity or confidence["margin"] < min_margin
+
+
+def record_rewrite(skipped: bool, rewrite_seconds: float = 0.0):
+    """
+    Records whether the query rewrite was skipped, and how long it took when it ran.
+
+    :param skipped: bool - True if retrieval used the original query only.
+    :param rewrite_seconds: float - Duration of the rewrite LLM call (default: 0.0).
+    """
+    with _rewrite_stats_lock:
+        if skipped:
+            _rewrite_stats["skipped"] += 1
+        else:
+            _rewrite_stats["rewritten"] += 1
+            _rewrite_stats["rewrite_seconds"] += rewrite_seconds
+
+
+def get_rewrite_stats() -> Dict:
+    """
+    Returns the rewrite counters collected since the process started. Saved latency is estimated
+    as the number of skipped rewrites times the average duration of the rewrites that ran.
+
+    :return: Dict - Counts of skipped and performed rewrites, skip rate and estimated seconds saved.
+    """
+    with _rewrite_stats_lock:
+        stats = dict(_rewrite_stats)
+    total = stats["skipped"] + stats["rewritten"]
+    average_rewrite = stats["rewrite_seconds"] / stats["rewritten"] if stats["rewritten"] else 0.0
+    stats["skip_rate"] = stats["skipped"] / total if total else 0.0
+    stats["estimated_seconds_saved"] = stats["skipped"] * average_rewrite
+    return stats
+
+
+def calibrate_rewrite_thresholds(vectorstore: FAISS,
+                                 queries: List[str],
+                                 quantile: float = 0.25,
+                                 k: int = 5,
+                                 save_path: Optional[str] = REWRITE_THRESHOLDS_PATH) -> Dict:
+    """
+    Derive the rewrite thresholds from the retrieval confidence of sample user queries.
+
+    Each threshold is the given quantile of its measure over the queries, so the weakest quarter
+    by similarity or by margin is rewritten by default. The score distribution and the skip rate
+    under the current and the derived thresholds are printed and saved with the thresholds.
+
+    :param vectorstore: FAISS - FAISS vector store instance, loaded with load_vectordb.
+    :param queries: List[str] - Sample user queries for the international student advisor.
+    :param quantile: float - Share of queries below each threshold (default: 0.25).
+    :param k: int - Number of chunks considered, as in chat_international (default: 5).
+    :param save_path: Optional[str] - JSON file the thresholds are saved to, read on import (default: REWRITE_THRESHOLDS_PATH, None to not save).
+    :return: Dict - The thresholds, the score percentiles and the skip rates.
+    """
+    _, confidences = hybrid_search_batch(vectorstore, queries, k=k, with_confidence=True)
+    top_similarities = np.asarray([confidence["top_similarity"] for confidence in confidences])
+    margins = np.asarray([confidence["margin"] for confidence in confidences])
+    thresholds = {
+        "min_similarity": round(float(np.quantile(top_similarities, quantile)), 4),
+        "min_margin": round(float(np.quantile(margins, quantile)), 4),
+    }
+
+    def skip_rate(min_similarity, min_margin):
+        return float(np.mean([not needs_query_rewrite(confidence, min_similarity, min_margin) for confidence in confidences]))
+
+    percentiles = [5, 25, 50, 75, 95]
+    result = {
+        **thresholds,
+        "queries": len(queries),
+        "quantile": quantile,
+        "top_similarity_percentiles": dict(zip(map(str, percentiles), np.percentile(top_similarities, percentiles).round(4).tolist())),
+        "margin_percentiles": dict(zip(map(str, percentiles), np.percentile(margins, percentiles).round(4).tolist())),
+        "skip_rate_before": skip_rate(REWRITE_MIN_SIMILARITY, REWRITE_MIN_MARGIN),
+        "skip_rate": skip_rate(thresholds["min_similarity"], thresholds["min_margin"]),
+    }
+    print(f"Rewrite calibration over {len(queries)} queries: top similarity percentiles {result['top_similarity_percentiles']}, "
+          f"margin percentiles {result['margin_percentiles']}")
+    print(f"Skip rate {result['skip_rate_before']:.0%} with min_similarity={REWRITE_MIN_SIMILARITY}, min_margin={REWRITE_MIN_MARGIN}; "
+          f"{result['skip_rate']:.0%} with min_similarity={thresholds['min_similarity']}, min_margin={thresholds['min_margin']}")
+    if save_path:
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+def hybrid_search_batch(vectorstore: FAISS,
+                        queries: List[str],
+                        k: int = 5,
+                        fetch_k: int = 20,
+                        filter_dict: Optional[Dict] = None,
+                        lexical_weight: float = 1.0,
+                        mmr: bool = False,
+                        lambda_mult: float = 0.5,
+                        with_confidence: bool = False):
+    """
+    Search several queries with dense (FAISS) and lexical (BM25) retrieval and fuse both rankings
+    per query with reciprocal rank fusion. Exact terms like "ITIN", "I-20" or "U-SHIP" that
+    embeddings blur are picked up by the lexical side, which runs in-process with no API call.
+    Stores without a lexical index fall back to dense search only. With mmr, the top fetch_k fused
+    chunks are reranked for diversity with mmr_select (unfiltered searches only).
+
+    :param vectorstore: FAISS - FAISS vector store instance, loaded with load_vectordb.
+    :param queries: List[str] - Search query strings.
+    :param k: int - Number of chunks to return per query (default: 5).
+    :param fetch_k: int - Number of candidates taken from each ranking before fusion (default: 20).
+    :param filter_dict: Optional[Dict] - Optional metadata filters (e.g., {"source_type": "uchicago"}).
+    :param lexical_weight: float - Weight of the BM25 ranking relative to the dense one (default: 1.0).
+    :param mmr: bool - Rerank the fused candidates for diversity (default: False).
+    :param lambda_mult: float - MMR trade-off, 1 for pure relevance and 0 for pure diversity (default: 0.5).
+    :param with_confidence: bool - Also return the retrieval confidence of every query, taken from the
+                            scores of the dense search (default: False).
+    :return: List[List[Document]] - One fused ranked list of Document objects per query, with a list of
+             retrieval_confidence dicts as second element if with_confidence.
+    """
+    results, dense_scores = _hybrid_search_batch(vectorstore, queries, k, fetch_k, filter_dict, lexical_weight,
+                                                 mmr, lambda_mult)
+    if not with_confidence:
+        return results
+    if dense_scores is None:
+        # Filtered searches and stores without a lexical index don't keep their dense scores
+        confidences = [retrieval_confidence(vectorstore, query, k) for query in queries]
+    else:
+        confidences = [confidence_from_scores(vectorstore, scores[:k]) for scores in dense_scores]
+    return results, confidences
+
+
+def _hybrid_search_batch(vectorstore: FAISS, queries: List[str], k: int, fetch_k: int, filter_dict: Optional[Dict],
+                         lexical_weight: float, mmr: bool, lambda_mult: float):
+    # Fused results per query, and the valid dense scores per query when the batched dense search ran
+    lexical_index = getattr(vectorstore, 'lexical_index', None)
+    if lexical_index is None:
+        if mmr:
+            return [search_similar_chunks(vectorstore, query, k=k, filter_dict=filter_dict, mmr=True,
+                                          fetch_k=fetch_k, lambda_mult=lambda_mult) for query in queries], None
+        return search_similar_chunks_batch(vectorstore, queries, k=k, filter_dict=filter_dict), None
+    if not queries:
+        return [], None
+
+    try:
+        # Filtered searches fuse at document level, the dense side handles the filter
+        if filter_dict:
+            dense_results = search_similar_chunks_batch(vectorstore, queries, k=fetch_k, filter_dict=filter_dict)
+            matches_filter = FAISS._create_filter_func(filter_dict)
+            results = []
+            for query, dense_docs in zip(queries, dense_results):
+                lexical_rows, _ = lexical_index.search(query, fetch_k * 4)
+                lexical_docs = [doc for doc in lookup_documents(vectorstore, lexical_rows) if matches_filter(doc.metadata)]
+                results.append(reciprocal_rank_fusion([dense_docs, lexical_docs[:fetch_k]], top_n=k))
+            return results, None
+
+        query_vectors = np.asarray(vectorstore.embedding_function.embed_documents(queries), dtype=np.float32)
+        if vectorstore._normalize_L2:
+            faiss.normalize_L2(query_vectors)
+        dense_scores, dense_indices = vectorstore.index.search(query_vectors, max(fetch_k, k))
+
+        results = []
+        for query, query_vector, dense_row in zip(queries, query_vectors, dense_indices):
+            lexical_rows, _ = lexical_index.search(query, fetch_k)
+            rankings = np.full((2, len(dense_row)), -1, dtype=np.int64)
+            rankings[0] = dense_row
+            rankings[1, :len(lexical_rows)] = lexical_rows
+            fused_rows, _ = reciprocal_rank_fusion_ids(rankings, weights=[1.0, lexical_weight],
+                                                       top_n=fetch_k if mmr else k)
+            if mmr:
+                fused_rows = mmr_rerank_rows(vectorstore, query_vector, fused_rows, k, lambda_mult)
+            results.append(lookup_documents(vectorstore, fused_rows))
+        return results, [scores[rows != -1] for scores, rows in zip(dense_scores, dense_indices)]
+
+    except Exception as e:
+        print(f"Error during hybrid search: {str(e)}")
+        return [[] for _ in queries], None
+
+
+def hybrid_search(vectorstore: FAISS,
+                  query: str,
+                  k: int = 5,
+                  fetch_k: int = 20,
+                  filter_dict: Optional[Dict] = None,
+                  lexical_weight: float = 1.0,
+                  mmr: bool = False,
+                  lambda_mult: float = 0.5,
+                  with_confidence: bool = False):
+    """
+    Search one query with fused dense and BM25 retrieval, see hybrid_search_batch.
+
+    :param vectorstore: FAISS - FAISS vector store instance, loaded with load_vectordb.
+    :param query: str - Search query string.
+    :param k: int - Number of chunks to return (default: 5).
+    :param fetch_k: int - Number of candidates taken from each ranking before fusion (default: 20).
+    :param filter_dict: Optional[Dict] - Optional metadata filters (e.g., {"source_type": "uchicago"}).
+    :param lexical_weight: float - Weight of the BM25 ranking relative to the dense one (default: 1.0).
+    :param mmr: bool - Rerank the fused candidates for diversity (default: False).
+    :param lambda_mult: float - MMR trade-off, 1 for pure relevance and 0 for pure diversity (default: 0.5).
+    :param with_confidence: bool - Also return the query's retrieval_confidence, from the same dense search (default: False).
+    :return: List[Document] - Fused ranked list of Document objects, and the confidence dict if with_confidence.
+    """
+    results = hybrid_search_batch(vectorstore, [query], k=k, fetch_k=fetch_k, filter_dict=filter_dict,
+                                  lexical_weight=lexical_weight, mmr=mmr, lambda_mult=lambda_mult,
+                                  with_confidence=with_confidence)
+    if with_confidence:
+        return results[0][0], results[1][0]
+    return results[0]
+
+
+def _trim_overlap(previous: str, following: str, max_overlap: int = 600, probe_length: int = 32) -> str:
+    # The splitter starts a chunk with the tail of the previous one, find that tail and cut it
+    probe = following[:probe_length]
+    if len(probe) < probe_length:
+        return following
+    tail_start = max(0, len(previous) - max_overlap)
+    position = previous.find(probe, tail_start)
+    while position != -1:
+        overlap = len(previous) - position
+        if following.startswith(previous[position:]):
+            return following[overlap:]
+        position = previous.find(probe, position + 1)
+    return following
+
+
+def pack_chunks(documents: List[Document], token_budget: Optional[int] = None) -> List[Document]:
+    """
+    Pack retrieved chunks into as few tokens as possible for the RAG prompt.
+
+    Chunks of the same source with consecutive chunk_index are merged into one block, with the
+    overlap the splitter repeats at the start of each chunk removed, or a line break between chunks
+    that don't overlap. Blocks are ordered by the
+    rank of their most relevant chunk, and added until the token budget is spent; the block that
+    crosses the budget is truncated at a sentence boundary.
+
+    :param documents: List[Document] - Retrieved chunks, most relevant first.
+    :param token_budget: Optional[int] - Maximum estimated tokens of chunk content (None for no limit).
+    :return: List[Document] - Packed blocks, most relevant first. Merged blocks get a chunk_index like "2-3".
+    """
+    # Rank of every distinct chunk, grouped per source
+    groups = {}
+    seen = set()
+    for rank, doc in enumerate(documents):
+        key = _fusion_key(doc)
+        if key in seen:
+            continue
+        seen.add(key)
+        groups.setdefault(doc.metadata.get('source'), []).append((rank, doc))
+
+    # Merge runs of consecutive chunks within each source
+    blocks = []
+    for members in groups.values():
+        members.sort(key=lambda member: (member[1].metadata.get('chunk_index') is None, member[1].metadata.get('chunk_index') or 0))
+        run = [members[0]]
+        for member in members[1:]:
+            previous_index = run[-1][1].metadata.get('chunk_index')
+            index = member[1].metadata.get('chunk_index')
+            if isinstance(previous_index, int) and isinstance(index, int) and index == previous_index + 1:
+                run.append(member)
+            else:
+                blocks.append(run)
+                run = [member]
+        blocks.append(run)
+
+    packed = []
+    used_tokens = 0
+    for run in sorted(blocks, key=lambda run: min(rank for rank, _ in run)):
+        content = run[0][1].page_content
+        for _, doc in run[1:]:
+            following = _trim_overlap(content, doc.page_content)
+            # Without an overlap the splitter stripped the whitespace at the boundary, put a break back
+            content += following if len(following) < len(doc.page_content) else "\n" + following
+        metadata = dict(run[0][1].metadata)
+        if len(run) > 1:
+            metadata['chunk_index'] = f"{run[0][1].metadata['chunk_index']}-{run[-1][1].metadata['chunk_index']}"
+
+        tokens = estimate_tokens(content)
+        if token_budget is not None and used_tokens + tokens > token_budget:
+            remaining = token_budget - used_tokens
+            # Skip a sliver of a block, but never return nothing
+            if remaining < 50 and packed:
+                break
+            content = truncate_to_tokens(content, max(remaining, 50), tokens=tokens)
+            tokens = estimate_tokens(content)
+        packed.append(Document(page_content=content, metadata=metadata))
+        used_tokens += tokens
+        if token_budget is not None and used_tokens >= token_budget:
+            break
+    return packed
+
+
 def format_chunk_results(documents: List[Document],
                          metadata_fields: Optional[List[str]] = None,
                          include_content: bool = True,
-                         max_content_length: Optional[int] = None) -> str:
+                         max_content_length: Optional[int] = None,
+                         pack: bool = False,
+                         token_budget: Optional[int] = None) -> str:
     """
     Format search results into a readable string.
 
@@ -83,10 +760,26 @@ def format_chunk_results(documents: List[Document],
     :param metadata_fields: Optional[List[str]] - List of metadata fields to include (None for all fields).
     :param include_content: bool - Whether to include the content in the output (default: True).
     :param max_content_length: Optional[int] - Maximum length of content to display (None for full content).
+    :param pack: bool - Merge adjacent chunks, trim overlaps and order by relevance with pack_chunks (default: False).
+    :param token_budget: Optional[int] - Token budget of the whole formatted result, headers and metadata included, implies pack (default: None).
     :return: str - Formatted string of search results.
     """
     if not documents:
         return "No results found."
+
+    if pack or token_budget is not None:
+        blocks = pack_chunks(documents, token_budget)
+        if token_budget is not None:
+            # The budget covers the header and metadata lines too: count them alone, without the
+            # content, and pack the content into what they leave (fewer blocks only shrink them)
+            frames = [Document(page_content="", metadata=block.metadata) for block in blocks]
+            overhead = estimate_tokens(format_chunk_results(frames, metadata_fields, include_content, max_content_length))
+            blocks = pack_chunks(documents, max(token_budget - overhead, 0))
+        characters_before = sum(len(doc.page_content) for doc in documents)
+        characters_after = sum(len(block.page_content) for block in blocks)
+        print(f"Context packing: {len(documents)} chunks -> {len(blocks)} blocks, "
+              f"{characters_before} -> {characters_after} characters of content")
+        return format_chunk_results(blocks, metadata_fields, include_content, max_content_length)
     
     # Default metadata fields if none specified
     default_fields = ['source', 'domain', 'source_type', 'chunk_index', 'total_chunks']
@@ -123,6 +816,16 @@ def format_chunk_results(documents: List[Document],
     return '\n'.join(output_parts)
 
 
+def _fusion_key(doc: Document):
+    """
+    Identity key of a document for fusion: its docstore id when set, otherwise its content and position.
+    """
+    doc_id = getattr(doc, 'id', None)
+    if doc_id:
+        return doc_id
+    return (doc.page_content, doc.metadata.get('source'), doc.metadata.get('chunk_index'))
+
+
 def reciprocal_rank_fusion(results: list[list], k=60, top_n=5):
     """
     Perform reciprocal rank fusion for merging multiple lists of ranked documents.
@@ -134,19 +837,69 @@ def reciprocal_rank_fusion(results: list[list], k=60, top_n=5):
     :return: list - Merged and reranked list of top_n documents.
     """
     fused_scores = {}
+    fused_docs = {}
 
     for docs in results:
         for rank, doc in enumerate(docs):
-            # Serialize doc to use as a dictionary key
-            doc_str = dumps(doc)
-            if doc_str not in fused_scores:
-                fused_scores[doc_str] = 0
-            fused_scores[doc_str] += 1 / (rank + k)
-        
-    reranked_results = [
-        (loads(doc), score)
-        for doc, score in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)
-    ]
+            # Key by docstore id (or content) and keep the original Document object
+            key = _fusion_key(doc)
+            if key not in fused_scores:
+                fused_scores[key] = 0
+                fused_docs[key] = doc
+            fused_scores[key] += 1 / (rank + k)
+
+    reranked_keys = sorted(fused_scores, key=fused_scores.get, reverse=True)
 
     # Return only the top_n documents
-    return [doc for doc, score in reranked_results[:top_n]]
\ No newline at end of file
+    return [fused_docs[key] for key in reranked_keys[:top_n]]
+
+
+def reciprocal_rank_fusion_ids(indices: np.ndarray,
+                               distances: Optional[np.ndarray] = None,
+                               weights: Optional[List[float]] = None,
+                               k: int = 60,
+                               top_n: int = 5,
+                               metric: int = faiss.METRIC_L2):
+    """
+    Weighted reciprocal rank fusion over raw FAISS search output, computed with NumPy.
+
+    Each hit contributes weight / (rank + k). With distances given, the contribution is also
+    scaled by the hit's similarity, so close matches count for more: 1 / (1 + distance) for L2
+    distances, and (1 + score) / 2 clipped to [0, 1] for inner-product (cosine) scores, where a
+    larger score is more similar.
+
+    :param indices: np.ndarray - FAISS row ids of shape (n_queries, k_per_query), -1 for padding.
+    :param distances: Optional[np.ndarray] - FAISS distances of the same shape (None for rank-only fusion).
+    :param weights: Optional[List[float]] - Weight per query (None for equal weights).
+    :param k: int - Smoothing factor for rank scores (default: 60).
+    :param top_n: int - Number of top-ranked ids to return (default: 5).
+    :param metric: int - Metric of the index the distances come from, e.g. vectorstore.index.metric_type (default: faiss.METRIC_L2).
+    :return: tuple - The fused FAISS row ids and their fused scores, best first.
+    """
+    indices = np.asarray(indices)
+    n_queries, n_hits = indices.shape
+
+    contributions = np.broadcast_to(1.0 / (np.arange(n_hits) + k), indices.shape).copy()
+    if weights is not None:
+        contributions *= np.asarray(weights, dtype=np.float64)[:, None]
+    if distances is not None:
+        distances = np.asarray(distances, dtype=np.float64)
+        if metric == faiss.METRIC_INNER_PRODUCT:
+            contributions *= np.clip((1.0 + distances) / 2.0, 0.0, 1.0)
+        else:
+            contributions *= 1.0 / (1.0 + distances)
+
+    valid = indices != -1
+    unique_ids, inverse = np.unique(indices[valid], return_inverse=True)
+    fused_scores = np.zeros(len(unique_ids))
+    np.add.at(fused_scores, inverse, contributions[valid])
+
+    order = np.argsort(-fused_scores, kind="stable")[:top_n]
+    return unique_ids[order], fused_scores[order]
+
+
+if __name__ == "__main__":
+    # Calibrate the rewrite thresholds: python vector_search.py <file with one user query per line>
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        sample_queries = [line.strip() for line in f if line.strip()]
+    calibrate_rewrite_thresholds(load_vectordb(os.path.join(os.path.dirname(__file__), 'data', 'vectordb')), sample_queries)
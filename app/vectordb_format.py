@@ -0,0 +1,733 @@
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections.abc import Mapping
+from typing import Optional, Union
+import faiss
+import numpy as np
+from langchain.schema import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.embeddings import Embeddings
+from lexical_index import BM25Index
+
+
+# On-disk layout of a vector store folder (format version 3):
+#   store.json       - format version, index type and parameters, metric, dimension, count, embedding model
+#                      and "data_dir", the folder under versions/ holding the data files below
+#   vectors.npy      - float32 vectors of shape (count, dimension); searched memory-mapped for the "flat"
+#                      index type, otherwise only kept as the exact source for rebuilds and updates
+#   index.faiss      - compressed / approximate FAISS index, for every index type except "flat"
+#   docstore.sqlite  - chunks(row, id, page_content, metadata) with the FAISS row of every chunk, and
+#                      for parent-document stores parents(id, page_content, metadata) with the parent
+#                      sections that chunks point to through their "parent_id" metadata
+#   lexical/         - BM25 inverted index over the chunk texts, keyed by FAISS row, as .npy arrays
+#                      that are memory-mapped on load (see lexical_index)
+# Every save writes a new data folder and then replaces store.json, so a reader always gets the data
+# files of one save. Stores saved with a shard field (e.g. source_type) keep the rows of each value
+# contiguous and list the row range of every value under "shards" in store.json; shards are views
+# over these rows and add no files of their own.
+# Versions 1 and 2 kept the data files next to store.json, with the BM25 index in lexical.npz;
+# version 1 also kept a shards/ folder of per-value sub-stores.
+FORMAT_VERSION = 3
+STORE_FILENAME = "store.json"
+VECTORS_FILENAME = "vectors.npy"
+INDEX_FILENAME = "index.faiss"
+DOCSTORE_FILENAME = "docstore.sqlite"
+LEXICAL_DIRNAME = "lexical"
+VERSIONS_DIRNAME = "versions"
+# Data files of versions 1 and 2, removed from the store folder when it is saved again
+LEGACY_FILENAMES = (VECTORS_FILENAME, INDEX_FILENAME, DOCSTORE_FILENAME, "lexical.npz")
+LEGACY_SHARDS_DIRNAME = "shards"
+
+# Rows copied at a time when saving
+SAVE_BLOCK_SIZE = 4096
+
+# flat: exact float32 | fp16: float16 scalar quantizer (1/2 size) | sq8: int8 scalar quantizer (1/4 size)
+# ivfpq: inverted file with product quantization (~1/50 size, approximate) | hnsw: graph index over float32 vectors
+INDEX_TYPES = ("flat", "fp16", "sq8", "ivfpq", "hnsw")
+
+
+class MmapFlatIndex:
+    """
+    Read-only exact-search index over a memory-mapped vector matrix.
+
+    Implements the subset of the FAISS index interface used by the LangChain FAISS vector store
+    (search, reconstruct, ntotal, d). The vectors stay in the OS page cache, so several worker
+    processes share one copy and loading costs no reads up front.
+    """
+
+    def __init__(self, vectors: np.ndarray, metric: int = faiss.METRIC_L2):
+        """
+        :param vectors: np.ndarray - Float32 matrix of shape (count, dimension), typically a np.memmap.
+        :param metric: int - faiss.METRIC_L2 or faiss.METRIC_INNER_PRODUCT (default: faiss.METRIC_L2).
+        """
+        self.vectors = vectors
+        self.metric_type = metric
+        self.ntotal, self.d = vectors.shape
+
+    def search(self, queries: np.ndarray, k: int):
+        k = min(k, self.ntotal)
+        return faiss.knn(np.ascontiguousarray(queries, dtype=np.float32), self.vectors, k, metric=self.metric_type)
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        return np.array(self.vectors[i])
+
+    def reconstruct_n(self, start: int, n: int) -> np.ndarray:
+        return np.array(self.vectors[start:start + n])
+
+    def reconstruct_batch(self, keys) -> np.ndarray:
+        return np.array(self.vectors[np.asarray(keys)])
+
+    def add(self, *args, **kwargs):
+        raise NotImplementedError("Memory-mapped vector stores are read-only, rebuild them with vectordb_creation")
+
+    def remove_ids(self, *args, **kwargs):
+        raise NotImplementedError("Memory-mapped vector stores are read-only, rebuild them with vectordb_creation")
+
+
+class _SQLiteReader:
+    """
+    Read-only SQLite access with one connection per thread.
+    """
+
+    def __init__(self, path: str):
+        self.uri = f"file:{os.path.abspath(path)}?mode=ro"
+        self._local = threading.local()
+
+    def execute(self, sql: str, params=()):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn.execute(sql, params)
+
+
+class SQLiteDocstore(Docstore):
+    """
+    Docstore that loads chunks (or parent sections) lazily by id from the store's SQLite file.
+    """
+
+    def __init__(self, reader: _SQLiteReader, table: str = "chunks"):
+        self.reader = reader
+        self.table = table
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self.reader.execute(
+            f"SELECT id, page_content, metadata FROM {self.table} WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        doc_id, page_content, metadata = row
+        return Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+
+    def add(self, texts):
+        raise NotImplementedError("SQLiteDocstore is read-only")
+
+    def delete(self, ids):
+        raise NotImplementedError("SQLiteDocstore is read-only")
+
+
+class SQLiteIndexToDocstoreId(Mapping):
+    """
+    Lazy FAISS row -> docstore id mapping backed by the store's SQLite file.
+
+    With an offset, row i maps to the chunk at row offset + i, for shards over a row range.
+    """
+
+    def __init__(self, reader: _SQLiteReader, count: int, offset: int = 0):
+        self.reader = reader
+        self.count = count
+        self.offset = offset
+
+    def __getitem__(self, row: int) -> str:
+        if not 0 <= int(row) < self.count:
+            raise KeyError(row)
+        result = self.reader.execute("SELECT id FROM chunks WHERE row = ?", (self.offset + int(row),)).fetchone()
+        if result is None:
+            raise KeyError(row)
+        return result[0]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        return iter(range(self.count))
+
+
+class ShardedFAISS(FAISS):
+    """
+    FAISS vector store with one sub-store per value of a metadata field.
+
+    A search whose filter constrains the shard field only searches the matching shards and merges
+    their results by score, instead of over-fetching from the whole index and discarding other
+    sources. Filtered searches therefore cost the same however much other content is indexed, and
+    always return k hits when the shards hold enough chunks. Unfiltered searches and filters on
+    other fields use the full index as before.
+
+    Each shard is an exact flat search over its contiguous slice of the memory-mapped vectors.npy,
+    reading chunks from the shared docstore, so shards cost no extra disk space or build time.
+    """
+
+    def __init__(self, *args, shard_field: str, shards: dict, **kwargs):
+        """
+        :param shard_field: str - Metadata field the store is partitioned by.
+        :param shards: dict - Shard value -> FAISS sub-store.
+        """
+        super().__init__(*args, **kwargs)
+        self.shard_field = shard_field
+        self.shards = shards
+
+    def route(self, filter):
+        """
+        Find the shards a metadata filter is limited to.
+
+        :param filter: Optional[dict] - LangChain metadata filter.
+        :return: Optional[tuple] - The matching shard stores and the rest of the filter (None if
+                 nothing is left), or None if the filter does not constrain the shard field.
+        """
+        if not isinstance(filter, dict) or self.shard_field not in filter:
+            return None
+        values = filter[self.shard_field]
+        values = values if isinstance(values, list) else [values]
+        shards = [self.shards[value] for value in values if value in self.shards]
+        rest = {key: value for key, value in filter.items() if key != self.shard_field}
+        return shards, rest or None
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, filter=None, fetch_k: int = 20, **kwargs):
+        routed = self.route(filter)
+        if routed is None:
+            return super().similarity_search_with_score_by_vector(embedding, k=k, filter=filter, fetch_k=fetch_k, **kwargs)
+
+        shards, rest = routed
+        results = []
+        for shard in shards:
+            results.extend(shard.similarity_search_with_score_by_vector(embedding, k=k, filter=rest, fetch_k=fetch_k, **kwargs))
+        # Scores are distances, except for inner product where larger is closer
+        results.sort(key=lambda result: result[1], reverse=self.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT)
+        return results[:k]
+
+
+def _largest_divisor_at_most(n: int, limit: int) -> int:
+    return max(m for m in range(1, min(n, limit) + 1) if n % m == 0)
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = "flat", metric: int = faiss.METRIC_L2, **params):
+    """
+    Build a FAISS index of the given type over a float32 vector matrix.
+
+    :param vectors: np.ndarray - Float32 matrix of shape (count, dimension).
+    :param index_type: str - One of INDEX_TYPES (default: "flat").
+    :param metric: int - faiss.METRIC_L2 or faiss.METRIC_INNER_PRODUCT (default: faiss.METRIC_L2).
+    :param params: Index parameters: nlist, m, nbits and nprobe for "ivfpq", hnsw_m and ef_search for "hnsw".
+    :return: tuple - The trained and filled FAISS index, and the parameters actually used.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+    used_params = {}
+
+    if index_type == "flat":
+        index = faiss.IndexFlat(dimension, metric)
+    elif index_type in ("fp16", "sq8"):
+        quantizer_type = faiss.ScalarQuantizer.QT_fp16 if index_type == "fp16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(dimension, quantizer_type, metric)
+    elif index_type == "ivfpq":
+        # Keep at least ~39 training points per centroid and per PQ code, as FAISS recommends
+        nlist = params.get("nlist") or max(1, min(int(4 * np.sqrt(count)), count // 39))
+        m = params.get("m") or _largest_divisor_at_most(dimension, 64)
+        nbits = params.get("nbits") or int(min(8, max(1, np.log2(max(count, 2)))))
+        nprobe = params.get("nprobe") or min(nlist, 8)
+        index = faiss.IndexIVFPQ(faiss.IndexFlat(dimension, metric), dimension, nlist, m, nbits, metric)
+        index.nprobe = nprobe
+        used_params = {"nlist": nlist, "m": m, "nbits": nbits, "nprobe": nprobe}
+    elif index_type == "hnsw":
+        hnsw_m = params.get("hnsw_m") or 32
+        ef_search = params.get("ef_search") or 64
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, metric)
+        index.hnsw.efSearch = ef_search
+        used_params = {"hnsw_m": hnsw_m, "ef_search": ef_search}
+    else:
+        raise ValueError(f"Unknown index type: {index_type}, expected one of {INDEX_TYPES}")
+
+    if not index.is_trained and count:
+        index.train(vectors)
+    if count:
+        index.add(vectors)
+    return index, used_params
+
+
+def _apply_search_params(index, index_type: str, params: dict):
+    if index_type == "ivfpq" and params.get("nprobe"):
+        index.nprobe = params["nprobe"]
+    elif index_type == "hnsw" and params.get("ef_search"):
+        index.hnsw.efSearch = params["ef_search"]
+
+
+def is_vectorstore_dir(path: str) -> bool:
+    """
+    Check whether a folder holds a vector store in this format.
+
+    :param path: str - Folder to check.
+    :return: bool - True if the folder contains a store.json.
+    """
+    return os.path.exists(os.path.join(path, STORE_FILENAME))
+
+
+def store_data_path(path: str, store_info: Optional[dict] = None) -> str:
+    """
+    Get the folder holding the data files of a vector store's current version.
+
+    :param path: str - Folder of the vector store.
+    :param store_info: Optional[dict] - Its store.json, if already read (default: None).
+    :return: str - The data folder (the store folder itself for format versions 1 and 2).
+    """
+    store_info = store_info if store_info is not None else read_store_info(path)
+    return os.path.join(path, store_info.get("data_dir", ""))
+
+
+def _remove_old_versions(path: str, keep):
+    # Data folders no store.json points to any more, and the data files of version 1 and 2 stores
+    versions_path = os.path.join(path, VERSIONS_DIRNAME)
+    for name in os.listdir(versions_path):
+        if os.path.join(VERSIONS_DIRNAME, name) not in keep:
+            shutil.rmtree(os.path.join(versions_path, name), ignore_errors=True)
+    if "" not in keep:
+        for filename in LEGACY_FILENAMES:
+            if os.path.exists(os.path.join(path, filename)):
+                os.remove(os.path.join(path, filename))
+        shutil.rmtree(os.path.join(path, LEGACY_SHARDS_DIRNAME), ignore_errors=True)
+
+
+def save_vectorstore(vectorstore: FAISS,
+                     path: str,
+                     embedding_model: Optional[str] = None,
+                     index_type: str = "flat",
+                     embedding_dimensions: Optional[int] = None,
+                     shard_field: Optional[str] = None,
+                     parent_docstore: Optional[Docstore] = None,
+                     **index_params):
+    """
+    Save a FAISS vector store in the versioned, pickle-free format.
+
+    The data files are written to a new folder under versions/, then store.json is replaced
+    atomically to point to it: readers get either the previous save or this one, never a mix.
+    The previous data folder is kept for readers that read store.json just before the switch,
+    older ones are removed. Vectors and chunks are copied in blocks of SAVE_BLOCK_SIZE rows, so
+    saving a mapped store (e.g. an AppendableStore) doesn't load its texts or vectors into memory.
+
+    :param vectorstore: FAISS - The vector store to save (its index must hold exact vectors).
+    :param path: str - Destination folder.
+    :param embedding_model: Optional[str] - Embedding model name recorded in store.json.
+    :param index_type: str - Index type used for searching, one of INDEX_TYPES (default: "flat").
+    :param embedding_dimensions: Optional[int] - Shortened embedding size requested from the API (None for the model default).
+    :param shard_field: Optional[str] - Metadata field to shard by, e.g. "source_type": rows are grouped by value and each value's row range is recorded (default: None).
+    :param parent_docstore: Optional[Docstore] - Parent sections referenced by the chunks' "parent_id" metadata
+                            (default: the vector store's parent_docstore attribute, if any).
+    :param index_params: Parameters passed to build_faiss_index.
+    """
+    previous_data_dir = read_store_info(path).get("data_dir", "") if is_vectorstore_dir(path) else None
+    data_dir = os.path.join(VERSIONS_DIRNAME, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    data_path = os.path.join(path, data_dir)
+    os.makedirs(data_path)
+    index = vectorstore.index
+    count = index.ntotal
+
+    def fetch_document(row):
+        doc_id = vectorstore.index_to_docstore_id[row]
+        doc = vectorstore.docstore.search(doc_id)
+        if not isinstance(doc, Document):
+            raise ValueError(f"Document {doc_id} for row {row} missing from the docstore")
+        return doc_id, doc
+
+    # Source row of every saved row, with the rows of every shard value made contiguous.
+    # Only row numbers are kept, texts are read again block by block below.
+    order = np.arange(count, dtype=np.int64)
+    shard_entries = []
+    if shard_field:
+        groups = {}
+        for row in range(count):
+            groups.setdefault(fetch_document(row)[1].metadata.get(shard_field), []).append(row)
+        order = np.concatenate([np.asarray(rows, dtype=np.int64) for rows in groups.values()]) if groups else order
+        start = 0
+        for value, rows in groups.items():
+            shard_entries.append({"value": value, "start": start, "count": len(rows)})
+            start += len(rows)
+
+    # Vectors, copied block by block into a memory-mapped file
+    vectors_path = os.path.join(data_path, VECTORS_FILENAME)
+    if count:
+        vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(count, index.d))
+        for block_start in range(0, count, SAVE_BLOCK_SIZE):
+            block = order[block_start:block_start + SAVE_BLOCK_SIZE]
+            vectors[block_start:block_start + len(block)] = index.reconstruct_batch(block)
+        vectors.flush()
+    else:
+        vectors = np.zeros((0, index.d), dtype=np.float32)
+        np.save(vectors_path, vectors)
+
+    # Compressed / approximate index
+    used_params = {}
+    if index_type != "flat":
+        compressed_index, used_params = build_faiss_index(vectors, index_type, index.metric_type, **index_params)
+        faiss.write_index(compressed_index, os.path.join(data_path, INDEX_FILENAME))
+    del vectors
+
+    # Chunks, keyed by FAISS row and docstore id
+    conn = sqlite3.connect(os.path.join(data_path, DOCSTORE_FILENAME))
+    conn.execute("CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+    parent_ids = {}
+    for block_start in range(0, count, SAVE_BLOCK_SIZE):
+        rows = []
+        for row, source_row in enumerate(order[block_start:block_start + SAVE_BLOCK_SIZE], block_start):
+            doc_id, doc = fetch_document(int(source_row))
+            rows.append((row, doc_id, doc.page_content, json.dumps(doc.metadata)))
+            parent_ids.setdefault(doc.metadata.get("parent_id"))
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+
+    # Parent sections, only those still referenced by a chunk
+    parent_docstore = parent_docstore or getattr(vectorstore, 'parent_docstore', None)
+    parent_count = 0
+    if parent_docstore is not None:
+        conn.execute("CREATE TABLE parents (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        parent_rows = []
+        for parent_id in parent_ids:
+            parent = parent_docstore.search(parent_id) if parent_id else None
+            if isinstance(parent, Document):
+                parent_rows.append((parent_id, parent.page_content, json.dumps(parent.metadata)))
+            if len(parent_rows) >= SAVE_BLOCK_SIZE:
+                conn.executemany("INSERT INTO parents VALUES (?, ?, ?)", parent_rows)
+                parent_count += len(parent_rows)
+                parent_rows = []
+        conn.executemany("INSERT INTO parents VALUES (?, ?, ?)", parent_rows)
+        parent_count += len(parent_rows)
+    conn.commit()
+
+    # Lexical index over the same rows, streamed from the new docstore
+    BM25Index.build(page_content for (page_content,) in conn.execute("SELECT page_content FROM chunks ORDER BY row")).save(
+        os.path.join(data_path, LEXICAL_DIRNAME))
+    conn.close()
+
+    store_info = {
+        "format_version": FORMAT_VERSION,
+        "index_type": index_type,
+        "index_params": used_params,
+        "metric": "inner_product" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+        "distance_strategy": vectorstore.distance_strategy.value,
+        "normalize_L2": vectorstore._normalize_L2,
+        "dimension": index.d,
+        "count": count,
+        "embedding_model": embedding_model,
+        "embedding_dimensions": embedding_dimensions,
+        "parents": parent_count,
+        "data_dir": data_dir,
+    }
+    if shard_field:
+        store_info["shards"] = {"field": shard_field, "values": shard_entries}
+    store_tmp = os.path.join(path, f"{STORE_FILENAME}.{os.getpid()}.tmp")
+    with open(store_tmp, "w", encoding="utf-8") as f:
+        json.dump(store_info, f, indent=2)
+
+    # The single switch from the previous save to this one
+    os.replace(store_tmp, os.path.join(path, STORE_FILENAME))
+    _remove_old_versions(path, keep={data_dir, previous_data_dir})
+
+
+def load_vectorstore(path: str, embeddings: Embeddings, in_memory: bool = False) -> FAISS:
+    """
+    Load a vector store saved with save_vectorstore.
+
+    By default the index is mapped (memory-mapped vectors for "flat", FAISS mmap for IVF-PQ,
+    otherwise the compressed index is read) and chunks are read lazily from SQLite, so the result
+    is read-only. With in_memory=True the exact vectors are loaded into a regular flat FAISS index
+    and an in-memory docstore that can be updated and saved again. Mapped stores saved with a
+    shard field are returned as a ShardedFAISS that routes filtered searches to their shards.
+    Mapped stores also get their memory-mapped BM25 index as `lexical_index` (None for in-memory stores,
+    whose rows change on update; it is rebuilt on save). Parent-document stores get their
+    parent sections as `parent_docstore` (None otherwise).
+
+    :param path: str - Folder of the vector store.
+    :param embeddings: Embeddings - Embedding model used for queries.
+    :param in_memory: bool - Load into a mutable in-memory store instead of mapping it (default: False).
+    :return: FAISS - Vector store object.
+    """
+    store_info = read_store_info(path)
+    if store_info.get("format_version") not in (1, 2, FORMAT_VERSION):
+        raise ValueError(f"Unsupported vector store format version: {store_info.get('format_version')}")
+
+    # Every file comes from the data folder of the store.json read above, even if a save switches it meanwhile
+    data_path = store_data_path(path, store_info)
+    metric = faiss.METRIC_INNER_PRODUCT if store_info["metric"] == "inner_product" else faiss.METRIC_L2
+    vectors = np.load(os.path.join(data_path, VECTORS_FILENAME), mmap_mode="r")
+    reader = _SQLiteReader(os.path.join(data_path, DOCSTORE_FILENAME))
+
+    if in_memory:
+        index = faiss.IndexFlatIP(store_info["dimension"]) if metric == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(store_info["dimension"])
+        if len(vectors):
+            index.add(np.ascontiguousarray(vectors))
+        docs, index_to_docstore_id = {}, {}
+        for row, doc_id, page_content, metadata in reader.execute("SELECT row, id, page_content, metadata FROM chunks ORDER BY row"):
+            docs[doc_id] = Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+            index_to_docstore_id[row] = doc_id
+        docstore = InMemoryDocstore(docs)
+    else:
+        index_type = store_info.get("index_type", "flat")
+        if index_type == "flat":
+            index = MmapFlatIndex(vectors, metric)
+        else:
+            index = faiss.read_index(os.path.join(data_path, INDEX_FILENAME), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            _apply_search_params(index, index_type, store_info.get("index_params", {}))
+            if index_type == "ivfpq":
+                # Lets stored vectors be reconstructed by row, e.g. for MMR reranking
+                index.make_direct_map()
+        docstore = SQLiteDocstore(reader)
+        index_to_docstore_id = SQLiteIndexToDocstoreId(reader, store_info["count"])
+
+    store_kwargs = dict(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+        normalize_L2=store_info["normalize_L2"],
+        distance_strategy=DistanceStrategy(store_info["distance_strategy"]),
+    )
+    # Version 1 shards were separate sub-stores, such stores load unsharded until they are saved again
+    shards_info = store_info.get("shards") if store_info["format_version"] > 1 else None
+    if shards_info and not in_memory:
+        # Exact search over each value's row range of the mapped vectors, chunks from the shared docstore
+        shards = {
+            entry["value"]: FAISS(
+                embedding_function=embeddings,
+                index=MmapFlatIndex(vectors[entry["start"]:entry["start"] + entry["count"]], metric),
+                docstore=docstore,
+                index_to_docstore_id=SQLiteIndexToDocstoreId(reader, entry["count"], offset=entry["start"]),
+                normalize_L2=store_info["normalize_L2"],
+                distance_strategy=DistanceStrategy(store_info["distance_strategy"]),
+            )
+            for entry in shards_info["values"]
+        }
+        vectorstore = ShardedFAISS(shard_field=shards_info["field"], shards=shards, **store_kwargs)
+    else:
+        vectorstore = FAISS(**store_kwargs)
+
+    if not store_info.get("parents"):
+        vectorstore.parent_docstore = None
+    elif in_memory:
+        vectorstore.parent_docstore = InMemoryDocstore({
+            parent_id: Document(id=parent_id, page_content=page_content, metadata=json.loads(metadata))
+            for parent_id, page_content, metadata in reader.execute("SELECT id, page_content, metadata FROM parents")
+        })
+    else:
+        vectorstore.parent_docstore = SQLiteDocstore(reader, table="parents")
+
+    lexical_path = os.path.join(data_path, LEXICAL_DIRNAME if store_info["format_version"] == FORMAT_VERSION else "lexical.npz")
+    vectorstore.lexical_index = BM25Index.load(lexical_path) if not in_memory and os.path.exists(lexical_path) else None
+    return vectorstore
+
+
+def read_store_info(path: str) -> dict:
+    """
+    Read store.json of a vector store folder.
+
+    :param path: str - Folder of the vector store.
+    :return: dict - The store information.
+    """
+    with open(os.path.join(path, STORE_FILENAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class AppendableStore:
+    """
+    Append-only staging folder for building a vector store batch by batch, e.g. as a build checkpoint.
+
+    vectors.f32 holds the raw float32 vectors and docstore.sqlite the chunks (and parent sections)
+    in the store schema. A batch is appended to both, then progress.json records the committed row
+    and parent counts together with the caller's state, so each batch costs only its own size. On
+    open, anything written past the committed counts (a batch interrupted by a crash) is cut off.
+    as_vectorstore maps the result read-only for save_vectorstore.
+    """
+
+    VECTORS_FILENAME = "vectors.f32"
+    PROGRESS_FILENAME = "progress.json"
+
+    def __init__(self, path: str):
+        """
+        :param path: str - Staging folder, created if missing and resumed if it holds a progress.json.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, self.VECTORS_FILENAME)
+        self.progress_path = os.path.join(path, self.PROGRESS_FILENAME)
+        self.progress = {"count": 0, "parents": 0, "dimension": None, "state": {}}
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                self.progress = json.load(f)
+
+        self.conn = sqlite3.connect(os.path.join(path, DOCSTORE_FILENAME))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS parents (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+        # Drop whatever an interrupted batch wrote after the last commit
+        self.conn.execute("DELETE FROM chunks WHERE row >= ?", (self.count,))
+        self.conn.execute("DELETE FROM parents WHERE rowid > ?", (self.progress["parents"],))
+        self.conn.commit()
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(self.count * (self.progress["dimension"] or 0) * 4)
+
+    @property
+    def count(self) -> int:
+        return self.progress["count"]
+
+    @property
+    def state(self) -> dict:
+        return self.progress["state"]
+
+    def append(self, vectors: np.ndarray, ids, documents, parents: Optional[dict] = None, state: Optional[dict] = None):
+        """
+        Append a batch and commit it together with the caller's state.
+
+        :param vectors: np.ndarray - Float32 vectors of the batch, shape (n, dimension).
+        :param ids: List[str] - Docstore id of every chunk.
+        :param documents: List[Document] - The chunks, in the order of the vectors.
+        :param parents: Optional[dict] - Parent id -> parent Document of the batch's chunks.
+        :param state: Optional[dict] - JSON-serializable state committed with the batch (e.g. finished URLs).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(vectors):
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", [
+                (self.count + i, doc_id, doc.page_content, json.dumps(doc.metadata))
+                for i, (doc_id, doc) in enumerate(zip(ids, documents))
+            ])
+            self.progress["dimension"] = vectors.shape[1]
+        if parents:
+            self.conn.executemany("INSERT INTO parents VALUES (?, ?, ?)", [
+                (parent_id, parent.page_content, json.dumps(parent.metadata)) for parent_id, parent in parents.items()
+            ])
+        self.conn.commit()
+
+        self.progress["count"] += len(vectors)
+        self.progress["parents"] += len(parents or {})
+        if state is not None:
+            self.progress["state"] = state
+        progress_tmp = self.progress_path + ".tmp"
+        with open(progress_tmp, "w", encoding="utf-8") as f:
+            json.dump(self.progress, f)
+        os.replace(progress_tmp, self.progress_path)
+
+    def iter_documents(self, table: str = "chunks"):
+        """
+        Iterate over the committed chunks (or parent sections) without loading them all.
+
+        :param table: str - "chunks" or "parents" (default: "chunks").
+        :return: Iterator[Document] - The stored documents.
+        """
+        for doc_id, page_content, metadata in self.conn.execute(f"SELECT id, page_content, metadata FROM {table}"):
+            yield Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+
+    def as_vectorstore(self, embeddings: Embeddings,
+                       distance_strategy: DistanceStrategy = DistanceStrategy.EUCLIDEAN_DISTANCE,
+                       normalize_L2: bool = False) -> FAISS:
+        """
+        Map the committed rows as a read-only FAISS vector store.
+
+        :param embeddings: Embeddings - Embedding model used for queries.
+        :param distance_strategy: DistanceStrategy - Distance of the vectors (default: Euclidean).
+        :param normalize_L2: bool - Whether vectors and queries are L2-normalized (default: False).
+        :return: FAISS - Vector store with a memory-mapped flat index and SQLite docstores.
+        """
+        dimension = self.progress["dimension"] or 1
+        if self.count:
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, dimension))
+        else:
+            vectors = np.zeros((0, dimension), dtype=np.float32)
+        metric = faiss.METRIC_INNER_PRODUCT if distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT else faiss.METRIC_L2
+        reader = _SQLiteReader(os.path.join(self.path, DOCSTORE_FILENAME))
+        vectorstore = FAISS(
+            embedding_function=embeddings,
+            index=MmapFlatIndex(vectors, metric),
+            docstore=SQLiteDocstore(reader),
+            index_to_docstore_id=SQLiteIndexToDocstoreId(reader, self.count),
+            normalize_L2=normalize_L2,
+            distance_strategy=distance_strategy,
+        )
+        vectorstore.parent_docstore = SQLiteDocstore(reader, table="parents") if self.progress["parents"] else None
+        vectorstore.lexical_index = None
+        return vectorstore
+
+    def remove(self):
+        """
+        Delete the staging folder.
+        """
+        self.conn.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def benchmark_index_types(vectors: np.ndarray,
+                          index_types=INDEX_TYPES,
+                          k: int = 5,
+                          n_queries: int = 100,
+                          metric: int = faiss.METRIC_L2,
+                          seed: int = 0) -> dict:
+    """
+    Compare index types against exact flat search: recall@k, search time and index size.
+
+    Queries are stored vectors with small Gaussian noise, so they resemble real queries that land
+    near indexed chunks. Recall@k is the share of the exact top-k found by the index.
+
+    :param vectors: np.ndarray - Float32 matrix of shape (count, dimension), e.g. vectors.npy of a store.
+    :param index_types: Iterable[str] - Index types to compare (default: all INDEX_TYPES).
+    :param k: int - Number of neighbors compared (default: 5).
+    :param n_queries: int - Number of benchmark queries (default: 100).
+    :param metric: int - faiss.METRIC_L2 or faiss.METRIC_INNER_PRODUCT (default: faiss.METRIC_L2).
+    :param seed: int - Random seed for query sampling (default: 0).
+    :return: dict - Per index type: recall_at_k, ms_per_query and size_bytes.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.integers(0, len(vectors), n_queries)]
+    queries = (sample + rng.normal(0, sample.std() * 0.5, sample.shape)).astype(np.float32)
+    k = min(k, len(vectors))
+    _, exact = faiss.knn(queries, vectors, k, metric=metric)
+
+    results = {}
+    for index_type in index_types:
+        index, _ = build_faiss_index(vectors, index_type, metric)
+        start_time = time.perf_counter()
+        _, found = index.search(queries, k)
+        elapsed = time.perf_counter() - start_time
+        recall = np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact)])
+        results[index_type] = {
+            "recall_at_k": float(recall),
+            "ms_per_query": elapsed / n_queries * 1000,
+            "size_bytes": int(faiss.serialize_index(index).nbytes),
+        }
+        print(f"{index_type:>6}: recall@{k} {recall:.3f}, {results[index_type]['ms_per_query']:.3f} ms/query, "
+              f"{results[index_type]['size_bytes'] / 1e6:.2f} MB")
+    return results
+
+
+def migrate_legacy_vectorstore(path: str, embedding_model: Optional[str] = None):
+    """
+    Convert a folder saved with FAISS.save_local (index.faiss + index.pkl) to this format.
+    Only run this on index.pkl files you created yourself, loading them unpickles arbitrary objects.
+
+    :param path: str - Folder of the legacy vector store, the new files are written next to it.
+    :param embedding_model: Optional[str] - Embedding model name recorded in store.json.
+    """
+    from langchain_community.embeddings import FakeEmbeddings
+    legacy = FAISS.load_local(path, FakeEmbeddings(size=1), allow_dangerous_deserialization=True)
+    save_vectorstore(legacy, path, embedding_model)
+    print(f"Converted {legacy.index.ntotal} vectors in {path}")
+
+
+if __name__ == "__main__":
+    migrate_legacy_vectorstore(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "text-embedding-3-small")